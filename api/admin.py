@@ -1,8 +1,14 @@
+from datetime import date, timedelta
+
 from django.contrib import admin
+from django.utils.html import format_html, format_html_join
+
+from libs.prayer_engine import TIME_NAMES, format_minutes
 from .models import (
     User, Mosque, MosqueUser, Subscription,
-    Device, Slider, TextMarquee, PrayerTime, MasjidConfiguration
+    Device, Slider, TextMarquee, PrayerTime, PrayerYear, MasjidConfiguration, PublishedSnapshot
 )
+from .packed_schedule import unpack_days, year_days
 
 
 # Inline for MosqueUser
@@ -72,9 +78,42 @@ class PrayerTimeAdmin(admin.ModelAdmin):
     search_fields = ('mosque__name', 'date')
 
 
+# Packed Prayer Year Admin
+@admin.register(PrayerYear)
+class PrayerYearAdmin(admin.ModelAdmin):
+    list_display = ('mosque', 'year', 'updated_at')
+    list_filter = ('year',)
+    search_fields = ('mosque__name',)
+    fields = ('mosque', 'year', 'schedule', 'updated_at')
+    readonly_fields = ('mosque', 'year', 'schedule', 'updated_at')
+
+    @admin.display(description='Schedule')
+    def schedule(self, obj):
+        first = date(obj.year, 1, 1)
+        days = unpack_days(obj.minutes, 0, year_days(obj.year))
+        rows = format_html_join('', '<tr><td>{}</td>{}</tr>', (
+            (
+                first + timedelta(days=offset),
+                format_html_join('', '<td>{}</td>', ((format_minutes(m),) for m in minutes))
+                if minutes else format_html('<td colspan="{}">-</td>', len(TIME_NAMES)),
+            )
+            for offset, minutes in enumerate(days)
+        ))
+        header = format_html_join('', '<th>{}</th>', ((name,) for name in ('date',) + TIME_NAMES))
+        return format_html('<table><tr>{}</tr>{}</table>', header, rows)
+
+
 # Masjid Configuration Admin
 @admin.register(MasjidConfiguration)
 class MasjidConfigurationAdmin(admin.ModelAdmin):
     list_display = ('mosque', 'max_sliders', 'max_text_marquee', 'prayer_duration_days', 'allow_calendar_access', 'created_at')
     list_filter = ('mosque',)
     search_fields = ('mosque__name',)
+
+
+# Published Snapshot Admin
+@admin.register(PublishedSnapshot)
+class PublishedSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('mosque', 'version', 'day', 'file', 'published_at')
+    search_fields = ('mosque__name',)
+    readonly_fields = ('mosque', 'version', 'day', 'file', 'previous_file', 'published_at')
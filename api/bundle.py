@@ -0,0 +1,144 @@
+"""
+Offline bundle of the TV content of a mosque.
+
+A single zip holding the rendered payload as ``tv-content.json`` and every
+slider background as ``files/<file id>/<file name>``, so a device can preload
+its whole window of prayer days in one request. The archive is streamed while
+it is built and written to ``STORAGE_BUNDLE`` at the same time; later requests
+for the same content version are served from that file.
+"""
+import os
+import uuid
+import zipfile
+
+from common.models import File
+from libs.storage import FILE_STORAGE, STORAGE_BUNDLE
+from .delta import version_datetime
+
+PAYLOAD_NAME = "tv-content.json"
+
+
+def bundle_name(mosque_id, version, day, days=None):
+    return "%s/%s-%s-%s.zip" % (mosque_id, day.strftime("%Y%m%d"), days or 0, version)
+
+
+def member_name(file_id, name):
+    return "files/%s/%s" % (file_id, os.path.basename(name))
+
+
+class StreamBuffer:
+    """
+    Write-only, unseekable file object for ``zipfile`` that keeps what was
+    written until it is drained into the response, and copies it to ``file``.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.file.write(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def bundle_files(data):
+    """
+    Return the ``(id, name)`` in storage of the files the TV content refers to.
+    """
+    ids = {
+        slider["background_image"]["id"]
+        for slider in data["sliders"]
+        if slider["background_image"] is not None
+    }
+    return list(
+        File.objects.filter(id__in=ids).exclude(file="").exclude(file=None)
+        .order_by("id").values_list("id", "file")
+    )
+
+
+def stream_bundle(mosque_id, snapshot, day, days=None):
+    """
+    Yield the zip of a TV content snapshot and its files, and keep it in
+    ``STORAGE_BUNDLE`` once it is complete. Media are stored as they are since
+    they are compressed already.
+    """
+    name = bundle_name(mosque_id, snapshot["version"], day, days)
+    path = STORAGE_BUNDLE.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = "%s.%s.part" % (path, uuid.uuid4().hex)
+    # The same entries and dates for the same version give the same bytes
+    date_time = version_datetime(snapshot["version"]).timetuple()[:6]
+
+    complete = False
+    try:
+        with open(partial, "wb") as file:
+            buffer = StreamBuffer(file)
+            with zipfile.ZipFile(buffer, "w") as archive:
+                archive.writestr(
+                    zipfile.ZipInfo(PAYLOAD_NAME, date_time), snapshot["body"],
+                    compress_type=zipfile.ZIP_DEFLATED,
+                )
+                yield buffer.drain()
+                for file_id, file_name in bundle_files(snapshot["data"]):
+                    try:
+                        source = FILE_STORAGE.open(file_name, "rb")
+                    except FileNotFoundError:
+                        continue
+                    with source, archive.open(
+                        zipfile.ZipInfo(member_name(file_id, file_name), date_time), "w",
+                        force_zip64=True,
+                    ) as target:
+                        for chunk in source.chunks():
+                            target.write(chunk)
+                            yield buffer.drain()
+            yield buffer.drain()
+        os.replace(partial, path)
+        complete = True
+    finally:
+        if not complete and os.path.exists(partial):
+            os.remove(partial)
+
+    prune_bundles(mosque_id, name)
+
+
+def prune_bundles(mosque_id, current):
+    """
+    Remove the bundles of a mosque built for another version or day than
+    ``current``.
+    """
+    keep = os.path.basename(current).split("-")
+    try:
+        names = STORAGE_BUNDLE.listdir(str(mosque_id))[1]
+    except FileNotFoundError:
+        return
+    for name in names:
+        parts = name.split("-")
+        if name.endswith(".zip") and (parts[0], parts[-1]) != (keep[0], keep[-1]):
+            STORAGE_BUNDLE.delete("%s/%s" % (mosque_id, name))
+
+
+def get_bundle(mosque_id, snapshot, day, days=None):
+    """
+    Return the finished bundle of a snapshot as an open file, or None when it
+    hasn't been built yet.
+    """
+    name = bundle_name(mosque_id, snapshot["version"], day, days)
+    try:
+        return STORAGE_BUNDLE.open(name, "rb")
+    except FileNotFoundError:
+        return None
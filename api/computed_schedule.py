@@ -0,0 +1,99 @@
+"""
+Computed prayer time backend.
+
+With ``PRAYER_TIME_BACKEND = "computed"`` the prayer schedule sent to TVs is
+computed from the mosque's coordinates when it is requested instead of read
+from stored ``PrayerTime`` rows, so nothing has to generate them. Computed
+days are kept in a bounded, per-process LRU keyed by location, calculation
+settings, timezone and date; the TV content snapshots in front of it already
+absorb most requests.
+"""
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+
+from libs.prayer_engine import TIME_NAMES
+from libs.prayertimes import ShalatSchedule, compute_fleet_times, TIME_OF_MINUTE
+from libs.schedule_grid import settings_digest
+
+# "stored" PrayerTime rows, "computed" on request, or "packed" PrayerYear rows
+PRAYER_TIME_BACKEND = getattr(settings, "PRAYER_TIME_BACKEND", "stored")
+PRAYER_TIME_TIMEZONE = getattr(settings, "PRAYER_TIME_TIMEZONE", 7)
+# Days kept in memory, about 350 bytes each
+PRAYER_SCHEDULE_LRU_SIZE = getattr(settings, "PRAYER_SCHEDULE_LRU_SIZE", 20000)
+
+
+def is_computed():
+    return PRAYER_TIME_BACKEND == "computed"
+
+
+class ScheduleLRU:
+    """
+    Least recently used computed prayer days. A day is a tuple of the
+    ``datetime.time`` of TIME_NAMES, or None when one of them doesn't occur.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.days = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def clear(self):
+        with self.lock:
+            self.days.clear()
+            self.hits = self.misses = 0
+
+    def get_days(self, latitude, longitude, dates, timezone=PRAYER_TIME_TIMEZONE):
+        """
+        Return the prayer times of a location on each date, computing the
+        missing ones in one go.
+        """
+        digest = settings_digest(ShalatSchedule(latitude, longitude).pray_times.getSettings())
+        keys = [(latitude, longitude, digest, timezone, day) for day in dates]
+        found = {}
+        with self.lock:
+            for key in keys:
+                times = self.days.get(key, self)
+                if times is not self:
+                    self.days.move_to_end(key)
+                    found[key] = times
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            start = min(key[-1] for key in missing)
+            count = (max(key[-1] for key in missing) - start).days + 1
+            _, minutes = compute_fleet_times([(0, latitude, longitude)], start, count, timezone)
+            computed = {}
+            for offset, day in enumerate(zip(*(minutes[name][0] for name in TIME_NAMES))):
+                times = None if min(day) < 0 else tuple(TIME_OF_MINUTE[minute] for minute in day)
+                computed[(latitude, longitude, digest, timezone, start + timedelta(days=offset))] = times
+            found.update(computed)
+            with self.lock:
+                self.days.update(computed)
+                while len(self.days) > self.maxsize:
+                    self.days.popitem(last=False)
+        return [found[key] for key in keys]
+
+
+schedules = ScheduleLRU(PRAYER_SCHEDULE_LRU_SIZE)
+
+
+def computed_prayer_schedule(mosque_id, latitude, longitude, day, days):
+    """
+    Compute the prayer times of the ``days`` days starting at ``day`` as
+    unsaved PrayerTime instances, leaving out days on which a time doesn't
+    occur like the stored rows would.
+    """
+    from .models import PrayerTime
+
+    dates = [day + timedelta(days=offset) for offset in range(days)]
+    return [
+        PrayerTime(mosque_id=mosque_id, date=date, **dict(zip(TIME_NAMES, times)))
+        for date, times in zip(dates, schedules.get_days(latitude, longitude, dates))
+        if times is not None
+    ]
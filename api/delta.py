@@ -0,0 +1,129 @@
+"""
+Changes of the TV content of a mosque since a content version.
+
+Content versions are microsecond timestamps (see ``api.snapshot``), so a
+device that holds version N only needs the rows updated after N, plus
+tombstones for the rows auditlog recorded as deleted after N. Rows are
+looked up from DELTA_OVERLAP before N, changes that took longer than that to
+commit are caught by ``needs_full_sync`` instead.
+"""
+from datetime import datetime, timedelta, timezone
+
+from auditlog.models import LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+
+from .models import Mosque, PrayerTime, Slider, TextMarquee, MasjidConfiguration
+from .snapshot import prayer_window_days, prayer_schedule_window, DELTA_OVERLAP
+from .computed_schedule import is_computed, computed_prayer_schedule
+from .packed_schedule import is_packed, packed_prayer_schedule
+from .serializers import (
+    MosqueDetailSerializer, PrayerScheduleSerializer, SliderSerializer,
+    TextMarqueeSerializer, MasjidConfigurationSerializer
+)
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Versions past it have no datetime
+MAX_VERSION = (datetime.max.replace(tzinfo=timezone.utc) - EPOCH) // timedelta(microseconds=1)
+
+
+def is_version(version):
+    return 0 <= version <= MAX_VERSION
+
+
+def version_datetime(version):
+    return EPOCH + timedelta(microseconds=version)
+
+
+def deleted_since(model, mosque_id, since_at, field="id"):
+    """
+    Return the ``field`` values of the rows of ``model`` belonging to the
+    mosque that were deleted after ``since_at``.
+    """
+    entries = LogEntry.objects.filter(
+        content_type=ContentType.objects.get_for_model(model),
+        action=LogEntry.Action.DELETE,
+        timestamp__gt=since_at,
+        changes__mosque__0=str(mosque_id),
+    ).values_list("object_id", "changes")
+    if field == "id":
+        return [object_id for object_id, _changes in entries]
+    return [changes[field][0] for _object_id, changes in entries]
+
+
+def changed_configuration_fields(configuration, since_at):
+    """
+    Return the names of the configuration fields auditlog recorded as
+    changed after ``since_at``, or None when it has no record of them.
+    """
+    entries = LogEntry.objects.get_for_object(configuration).filter(
+        timestamp__gt=since_at,
+    ).values_list("changes", flat=True)
+    fields = set()
+    for changes in entries:
+        fields.update(changes or {})
+    return fields or None
+
+
+def build_tv_content_delta(mosque_id, since, day, days=None):
+    """
+    Serialize the TV content of a mosque that changed after content version
+    ``since``. The mosque and configuration are left out when unchanged.
+
+    The prayer schedule holds the days of the window that changed, and the
+    days that moved into the window since the device got ``since``.
+    """
+    since_at = version_datetime(since) - DELTA_OVERLAP
+    delta = {}
+
+    mosque = Mosque.objects.get(pk=mosque_id)
+    if mosque.updated_at > since_at:
+        delta["mosque"] = MosqueDetailSerializer(mosque).data
+
+    configuration = MasjidConfiguration.objects.filter(mosque_id=mosque_id).first()
+    days = prayer_window_days(configuration and configuration.prayer_duration_days, days)
+    entered_window = since_at.date() + timedelta(days=days)
+    if is_computed():
+        # Computed days only change with the mosque's location
+        prayer_schedule = [
+            prayer_time for prayer_time in computed_prayer_schedule(
+                mosque_id, mosque.latitude, mosque.longitude, day, days
+            )
+            if "mosque" in delta or prayer_time.date >= entered_window
+        ]
+    elif is_packed():
+        # A day changes with the year it is packed in
+        prayer_schedule = [
+            prayer_time for prayer_time in packed_prayer_schedule(mosque_id, day, days)
+            if prayer_time.updated_at > since_at or prayer_time.date >= entered_window
+        ]
+    else:
+        prayer_schedule = prayer_schedule_window(mosque_id, day, days).filter(
+            Q(updated_at__gt=since_at) | Q(date__gte=entered_window)
+        )
+    sliders = Slider.objects.filter(mosque_id=mosque_id, updated_at__gt=since_at)
+    text_marquee = TextMarquee.objects.filter(mosque_id=mosque_id, updated_at__gt=since_at)
+    delta["prayer_schedule"] = PrayerScheduleSerializer(prayer_schedule, many=True).data
+    delta["sliders"] = SliderSerializer(sliders, many=True).data
+    delta["text_marquee"] = TextMarqueeSerializer(text_marquee, many=True).data
+
+    if configuration and configuration.updated_at > since_at:
+        data = MasjidConfigurationSerializer(configuration).data
+        fields = changed_configuration_fields(configuration, since_at)
+        if fields is not None:
+            fields.update(["id", "updated_at"])
+            data = {key: value for key, value in data.items() if key in fields}
+        delta["configurations"] = data
+
+    deleted_days = [
+        date for date in deleted_since(PrayerTime, mosque_id, since_at, field="date")
+        if date >= day.isoformat()
+    ]
+    delta["deleted"] = {
+        "prayer_schedule": deleted_days,
+        "sliders": deleted_since(Slider, mosque_id, since_at),
+        "text_marquee": deleted_since(TextMarquee, mosque_id, since_at),
+    }
+    return delta
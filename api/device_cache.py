@@ -0,0 +1,118 @@
+"""
+Cached resolution of device tokens for the unauthenticated device endpoints.
+
+A token maps to the device id, its mosque id and whether it is active, kept in
+the ``DEVICE_CACHE`` cache apart from the TV content snapshots. Unknown tokens
+are cached too, for a shorter time and in their own cache, so requests with
+made-up tokens don't reach the database and a scan of them can't evict the
+known devices. A client whose lookups keep missing is throttled by
+``UnknownDeviceThrottle`` instead of looked up. Entries are dropped by the
+``Device`` receivers in ``api.models``; changes made with ``QuerySet.update``
+only show after ``DEVICE_TIMEOUT``.
+"""
+import hashlib
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import SimpleRateThrottle
+
+DEVICE_CACHE = getattr(settings, "DEVICE_CACHE", "devices")
+DEVICE_TIMEOUT = getattr(settings, "DEVICE_CACHE_TIMEOUT", 60 * 60)
+UNKNOWN_DEVICE_CACHE = getattr(settings, "UNKNOWN_DEVICE_CACHE", "unknown_devices")
+UNKNOWN_DEVICE_TIMEOUT = getattr(settings, "UNKNOWN_DEVICE_CACHE_TIMEOUT", 15)
+
+DeviceInfo = namedtuple("DeviceInfo", ["id", "mosque_id", "is_active"])
+
+
+def device_key(device_token):
+    # Tokens are arbitrary strings, hash them into a valid cache key
+    return "device:%s" % hashlib.sha1(device_token.encode()).hexdigest()
+
+
+def get_device_cache():
+    return caches[DEVICE_CACHE]
+
+
+def get_unknown_cache():
+    return caches[UNKNOWN_DEVICE_CACHE]
+
+
+class UnknownDeviceThrottle(SimpleRateThrottle):
+    """
+    Limits the unknown device tokens a client looks up, at the
+    ``unknown_device`` rate of ``DEFAULT_THROTTLE_RATES``. Clients are told
+    apart by ``get_ident``, behind ``NUM_PROXIES`` proxies. Only lookups
+    that miss are counted, by ``record_miss``.
+    """
+    scope = "unknown_device"
+
+    @property
+    def cache(self):
+        return get_unknown_cache()
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {"scope": self.scope, "ident": self.get_ident(request)}
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        self.history = self.cache.get(self.key, [])
+        self.now = self.timer()
+        while self.history and self.history[-1] <= self.now - self.duration:
+            self.history.pop()
+        return len(self.history) < self.num_requests
+
+    def record_miss(self):
+        if self.rate is not None:
+            self.throttle_success()
+
+
+def resolve_device(device_token, request=None):
+    """
+    Return the DeviceInfo of a device token, or None if no device has it.
+
+    :param request: The request looking the token up. Once its client
+        looked up too many unknown tokens, tokens that aren't cached raise
+        ``Throttled``.
+    """
+    cache = get_device_cache()
+    key = device_key(device_token)
+    cached = cache.get(key)
+    if cached is not None:
+        return DeviceInfo(*cached)
+    unknown = get_unknown_cache()
+    if unknown.get(key) is not None:
+        return None
+    throttle = UnknownDeviceThrottle() if request is not None else None
+    if throttle is not None and not throttle.allow_request(request, None):
+        raise Throttled(wait=throttle.wait(), detail="Too many unknown devices.")
+
+    from .models import Device
+    row = Device.objects.filter(device_token=device_token).values_list(
+        "id", "mosque_id", "is_active"
+    ).first()
+    if row:
+        cache.set(key, tuple(row), DEVICE_TIMEOUT)
+        return DeviceInfo(*row)
+
+    unknown.set(key, True, UNKNOWN_DEVICE_TIMEOUT)
+    if throttle is not None:
+        throttle.record_miss()
+    return None
+
+
+def invalidate_device(device_token):
+    """
+    Drop the cached resolution of a token once the current transaction commits.
+    """
+    key = device_key(device_token)
+
+    def delete():
+        get_device_cache().delete(key)
+        get_unknown_cache().delete(key)
+
+    transaction.on_commit(delete)
@@ -0,0 +1,210 @@
+"""
+Hot-path encoder of the TV content.
+
+Produces the same bytes as rendering ``TVContentSerializer`` with DRF's
+``JSONRenderer``, from ``.values()`` queries instead of model instances and
+serializer fields, and dumps them with orjson when it is installed.
+"""
+import json
+import math
+from datetime import date
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601
+from rest_framework.settings import api_settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+from common.models import File
+from .models import Mosque, Slider, TextMarquee, MasjidConfiguration
+from .snapshot import prayer_window_days, prayer_schedule_window
+from .computed_schedule import is_computed, computed_prayer_schedule
+from .packed_schedule import is_packed, packed_prayer_schedule
+from .serializers import (
+    MosqueDetailSerializer, PrayerScheduleSerializer, TextMarqueeSerializer,
+    MasjidConfigurationSerializer
+)
+
+MOSQUE_FIELDS = MosqueDetailSerializer.Meta.fields
+PRAYER_FIELDS = PrayerScheduleSerializer.Meta.fields
+MARQUEE_FIELDS = TextMarqueeSerializer.Meta.fields
+CONFIGURATION_FIELDS = MasjidConfigurationSerializer.Meta.fields
+
+# The values the ModelSerializers read under these names
+SOURCES = {"mosque": "mosque_id"}
+
+
+class UnsupportedContent(Exception):
+    """
+    The content can't be encoded identically to the serializer.
+    """
+
+
+def is_supported():
+    """
+    The encoder only reproduces DRF's default ISO 8601 formats.
+    """
+    return (
+        api_settings.DATETIME_FORMAT == ISO_8601
+        and api_settings.DATE_FORMAT == ISO_8601
+        and api_settings.TIME_FORMAT == ISO_8601
+    )
+
+
+def encode_datetime(value, tz):
+    # DateTimeField.to_representation for ISO 8601
+    if value is None:
+        return None
+    value = value.astimezone(tz).isoformat() if tz else value.isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+def encode_float(value):
+    # Python and orjson format floats differently in exponent notation, and
+    # JSONRenderer refuses what isn't finite
+    if not math.isfinite(value) or (value and abs(value) < 1e-4):
+        raise UnsupportedContent("float %r" % value)
+    return float(value)
+
+
+def encode_row(row, fields, tz):
+    data = {}
+    for field in fields:
+        value = row[SOURCES.get(field, field)]
+        if field in ("created_at", "updated_at"):
+            value = encode_datetime(value, tz)
+        data[field] = value
+    return data
+
+
+def tv_content_data(mosque_id, day, days=None):
+    """
+    Return the TV content of a mosque as the plain data TVContentSerializer
+    would give, with the prayer schedule of ``days`` days from ``day``.
+
+    Raises UnsupportedContent when it can't match the serializer.
+    """
+    if not is_supported():
+        raise UnsupportedContent("non ISO 8601 formats")
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+    storage = File._meta.get_field("file").storage
+
+    mosque = Mosque.objects.values(*MOSQUE_FIELDS).get(pk=mosque_id)
+    mosque["latitude"] = encode_float(mosque["latitude"])
+    mosque["longitude"] = encode_float(mosque["longitude"])
+
+    configurations = MasjidConfiguration.objects.filter(mosque_id=mosque_id).order_by("id").values(
+        *[SOURCES.get(field, field) for field in CONFIGURATION_FIELDS]
+    ).first()
+    if configurations is not None:
+        configurations = encode_row(configurations, CONFIGURATION_FIELDS, tz)
+
+    days = prayer_window_days(configurations and configurations["prayer_duration_days"], days)
+    if is_computed():
+        rows = [
+            [getattr(prayer_time, field) for field in PRAYER_FIELDS]
+            for prayer_time in computed_prayer_schedule(
+                mosque_id, mosque["latitude"], mosque["longitude"], day, days
+            )
+        ]
+    elif is_packed():
+        rows = [
+            [getattr(prayer_time, field) for field in PRAYER_FIELDS]
+            for prayer_time in packed_prayer_schedule(mosque_id, day, days)
+        ]
+    else:
+        rows = prayer_schedule_window(mosque_id, day, days).values_list(*PRAYER_FIELDS)
+    prayer_schedule = [
+        {field: value.isoformat() for field, value in zip(PRAYER_FIELDS, row)}
+        for row in rows
+    ]
+
+    sliders = []
+    for row in Slider.objects.filter(mosque_id=mosque_id).values(
+        "id", "mosque_id", "background_image_id", "text", "created_at",
+        "background_image__name", "background_image__file",
+    ):
+        background_image = row["background_image_id"]
+        if background_image is not None:
+            # FileLiteSerializer
+            name = row["background_image__file"]
+            size = storage.size(name) if name else None
+            background_image = {
+                "id": background_image,
+                "name": row["background_image__name"],
+                "url": storage.url(name) if name else "-",
+                "file_size": size or None,
+            }
+        sliders.append({
+            "id": row["id"],
+            "mosque": row["mosque_id"],
+            "background_image": background_image,
+            "text": row["text"],
+            "created_at": encode_datetime(row["created_at"], tz),
+        })
+
+    text_marquee = [
+        encode_row(row, MARQUEE_FIELDS, tz)
+        for row in TextMarquee.objects.filter(mosque_id=mosque_id).values(
+            *[SOURCES.get(field, field) for field in MARQUEE_FIELDS]
+        )
+    ]
+
+    return {
+        "mosque": mosque,
+        "prayer_schedule": prayer_schedule,
+        "sliders": sliders,
+        "text_marquee": text_marquee,
+        "configurations": configurations,
+    }
+
+
+def render_json(data):
+    """
+    Render data as DRF's JSONRenderer does with the default settings.
+    """
+    if orjson is not None:
+        body = orjson.dumps(data)
+    else:
+        body = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+    # JSONRenderer escapes the separators that aren't valid in JavaScript strings
+    return body.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
+
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def compact_tv_content(data):
+    """
+    Reshape TV content data for the binary format: the prayer schedule
+    becomes one array per column, with dates as days since 1970-01-01 and
+    times as minutes since midnight.
+    """
+    schedule = {field: [] for field in PRAYER_FIELDS}
+    for day in data["prayer_schedule"]:
+        schedule["date"].append(date.fromisoformat(day["date"]).toordinal() - EPOCH_ORDINAL)
+        for field in PRAYER_FIELDS[1:]:
+            hours, minutes = day[field].split(":")[:2]
+            schedule[field].append(int(hours) * 60 + int(minutes))
+    return {**data, "prayer_schedule": schedule}
+
+
+def render_msgpack(data):
+    """
+    Render TV content data in the compact binary format, or None when the
+    msgpack package isn't installed.
+    """
+    if msgpack is None:
+        return None
+    return msgpack.packb(compact_tv_content(data), use_bin_type=True)
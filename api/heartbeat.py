@@ -0,0 +1,99 @@
+"""
+Write-behind buffer of device sync times.
+
+Every poll of a device would otherwise be a single-row UPDATE of
+``Device.last_synced_at``. Polls only record the time in process memory, and a
+background thread writes the latest time of every device in ``bulk_update``
+batches every ``FLUSH_INTERVAL`` seconds, which bounds how stale the column is.
+Whatever is pending is flushed when a worker that started the thread exits.
+With ``DEVICE_HEARTBEATS`` off, as under the tests, nothing is recorded.
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, "DEVICE_HEARTBEAT_FLUSH_INTERVAL", 60)
+BATCH_SIZE = getattr(settings, "DEVICE_HEARTBEAT_BATCH_SIZE", 500)
+ENABLED = getattr(settings, "DEVICE_HEARTBEATS", True)
+
+
+class HeartbeatBuffer:
+
+    def __init__(self, interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE, enabled=ENABLED):
+        self.enabled = enabled
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.thread = None
+        self.pid = None
+        self.stopped = threading.Event()
+
+    def record(self, device_id, synced_at=None):
+        """
+        Remember that a device synced, to be written on the next flush.
+        Without an interval, only explicit flushes write it.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.pending[device_id] = synced_at or now()
+        if self.interval:
+            self.start()
+
+    def flush(self):
+        """
+        Write the pending sync times to the database.
+
+        :return: The number of devices written.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+
+        from .models import Device
+        devices = [
+            Device(pk=device_id, last_synced_at=synced_at)
+            for device_id, synced_at in pending.items()
+        ]
+        # bulk_update sends no signals, so cached device lookups and TV
+        # content aren't invalidated by heartbeats
+        Device.objects.bulk_update(devices, ["last_synced_at"], batch_size=self.batch_size)
+        return len(devices)
+
+    def start(self):
+        # Workers forked from a master that already started the thread don't
+        # inherit it, hence the pid check
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(
+                target=self.run, name="device-heartbeat-flush", daemon=True
+            )
+            self.thread.start()
+            # Once per process, forked ones inherit the registration
+            atexit.unregister(self.flush)
+            atexit.register(self.flush)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush device heartbeats")
+            finally:
+                connection.close()
+
+
+heartbeats = HeartbeatBuffer()
@@ -0,0 +1,60 @@
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+from api.computed_schedule import ScheduleLRU, computed_prayer_schedule, schedules
+from api.models import Mosque, PrayerTime
+from api.snapshot import prayer_schedule_window, DEFAULT_PRAYER_DAYS
+
+
+class Command(BaseCommand):
+    help = "Compare the stored and computed prayer time backends on latency and memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=DEFAULT_PRAYER_DAYS, help="Prayer days per window")
+        parser.add_argument("--mosques", type=int, default=200, help="Mosques to read the windows of")
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        mosques = list(Mosque.objects.order_by("id").values_list("id", "latitude", "longitude")[:options["mosques"]])
+        if not mosques:
+            raise CommandError("There are no mosques to benchmark.")
+        day = now().date()
+
+        def stored():
+            for mosque_id, _, _ in mosques:
+                list(prayer_schedule_window(mosque_id, day, days))
+
+        def computed():
+            for mosque in mosques:
+                computed_prayer_schedule(*mosque, day, days)
+
+        schedules.clear()
+        timings = {}
+        for name, path in (("stored", stored), ("computed cold", computed), ("computed warm", computed)):
+            started = time.perf_counter()
+            path()
+            timings[name] = (time.perf_counter() - started) / len(mosques) * 1000
+            self.stdout.write("%-14s %8.3f ms per window" % (name, timings[name]))
+
+        # Memory held by an LRU filled with every window
+        lru = ScheduleLRU(len(mosques) * days)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        dates = [day + timedelta(days=offset) for offset in range(days)]
+        for _, latitude, longitude in mosques:
+            lru.get_days(latitude, longitude, dates)
+        held = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        entries = len(lru.days)
+        self.stdout.write(
+            "LRU memory     %8.1f KB for %d days, %d bytes per day" % (held / 1024, entries, held / entries)
+        )
+        self.stdout.write(self.style.SUCCESS(
+            "%d stored prayer time rows would not be needed; stored is %.1fx the warm computed latency"
+            % (PrayerTime.objects.count(), timings["stored"] / timings["computed warm"])
+        ))
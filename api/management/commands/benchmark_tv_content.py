@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+from rest_framework.renderers import JSONRenderer
+
+from api.encoders import tv_content_data, render_json
+from api.models import Mosque
+from api.snapshot import build_tv_content
+
+
+class Command(BaseCommand):
+    help = "Compare the TV content serializer with the hot-path encoder on a mosque."
+
+    def add_arguments(self, parser):
+        parser.add_argument("mosque_id", type=int, help="ID of the mosque to encode")
+        parser.add_argument("--days", type=int, default=None, help="Prayer days in the payload")
+        parser.add_argument("--iterations", type=int, default=200, help="Encodings per path")
+
+    def handle(self, *args, **options):
+        mosque_id = options["mosque_id"]
+        days = options["days"]
+        iterations = options["iterations"]
+        if not Mosque.objects.filter(pk=mosque_id).exists():
+            raise CommandError("Mosque %s does not exist." % mosque_id)
+        day = now().date()
+        renderer = JSONRenderer()
+
+        def serializer_path():
+            return renderer.render(build_tv_content(mosque_id, day, days))
+
+        def encoder_path():
+            return render_json(tv_content_data(mosque_id, day, days))
+
+        expected = serializer_path()
+        if encoder_path() != expected:
+            raise CommandError("The encoder output differs from the serializer output.")
+
+        timings = {}
+        for name, path in (("serializer", serializer_path), ("encoder", encoder_path)):
+            started = time.perf_counter()
+            for _ in range(iterations):
+                path()
+            timings[name] = (time.perf_counter() - started) / iterations * 1000
+            self.stdout.write("%-10s %8.3f ms per payload" % (name, timings[name]))
+
+        self.stdout.write(self.style.SUCCESS(
+            "%d bytes, %.1fx faster" % (len(expected), timings["serializer"] / timings["encoder"])
+        ))
@@ -0,0 +1,212 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+
+from api.computed_schedule import is_computed
+from api.models import Mosque, PrayerTime, PrayerYear
+from api.packed_schedule import is_packed, prayer_year_rows, upsert_prayer_years, year_days
+from api.snapshot import DEFAULT_PRAYER_DAYS, MAX_PRAYER_DAYS
+from libs.prayer_engine import TIME_NAMES
+from libs.prayertimes import compute_fleet_times, upsert_prayer_times, TIME_OF_MINUTE
+
+
+def prayer_time_rows(ids, times, start, days):
+    """
+    Build the PrayerTime rows of computed fleet times, leaving out the days
+    the sun doesn't rise or set.
+
+    :return: The rows, and the number of days left out.
+    """
+    dates = [start + timedelta(days=offset) for offset in range(days)]
+    rows = []
+    skipped = 0
+    for index, mosque_id in enumerate(ids):
+        for day, minutes in zip(dates, zip(*(times[name][index] for name in TIME_NAMES))):
+            if min(minutes) < 0:
+                skipped += 1
+                continue
+            rows.append(PrayerTime(
+                mosque_id=mosque_id, date=day,
+                **{name: TIME_OF_MINUTE[minute] for name, minute in zip(TIME_NAMES, minutes)}
+            ))
+    return rows, skipped
+
+
+def write_times(ids, times, start, days, batch_size, packed):
+    """
+    Upsert computed fleet times as PrayerTime rows, or as PrayerYear rows
+    when ``packed``, in which case they span the year of ``start``.
+
+    :return: The number of days left out.
+    """
+    if packed:
+        rows, skipped = prayer_year_rows(ids, times, start.year)
+        upsert_prayer_years(rows, batch_size)
+    else:
+        rows, skipped = prayer_time_rows(ids, times, start, days)
+        upsert_prayer_times(rows, batch_size)
+    return skipped
+
+
+def compute_chunk(chunk, start, days, timezone, batch_size, write, packed):
+    """
+    Compute the times of a chunk of mosques, and with ``write`` also upsert
+    them from the worker.
+
+    :return: The mosque ids, and the computed times or, when written, the
+        number of days left out.
+    """
+    ids, times = compute_fleet_times(chunk, start, days, timezone)
+    if not write:
+        return ids, times
+    return ids, write_times(ids, times, start, days, batch_size, packed)
+
+
+def packed_windows(today, end, last_year, full):
+    """
+    Whole years to compute so that a mosque's PrayerYear rows cover today
+    up to ``end``, excluded, as (January 1st, days of the year).
+    """
+    first = today.year
+    if not full and last_year is not None and last_year >= first:
+        first = last_year + 1
+    return [(date(year, 1, 1), year_days(year)) for year in range(first, (end - timedelta(days=1)).year + 1)]
+
+
+def setup_worker():
+    # Needed when workers are spawned rather than forked
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        "Extend the prayer times of all mosques, or the given ones, up to their "
+        "window, computing only the missing days in a process pool. With the packed "
+        "backend, the missing whole years are stored instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mosque", type=int, action="append", dest="mosque_ids",
+            help="ID of a mosque to generate, may be repeated (default: all mosques)",
+        )
+        parser.add_argument(
+            "--active", action="store_true",
+            help="Only mosques whose subscription hasn't expired",
+        )
+        parser.add_argument(
+            "--days", type=int, default=None,
+            help="Days to generate from today (default: each mosque's prayer_duration_days)",
+        )
+        parser.add_argument(
+            "--full", action="store_true",
+            help="Recompute the whole window, not only the days after each mosque's last one",
+        )
+        parser.add_argument("--timezone", type=int, default=7, help="Timezone offset in hours")
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(), help="Worker processes computing the times"
+        )
+        parser.add_argument("--chunk-size", type=int, default=200, help="Mosques per worker task")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per bulk_create batch")
+        parser.add_argument(
+            "--write-in-workers", action="store_true",
+            help="Insert rows from the workers over their own connections instead of the parent "
+                 "(not with SQLite, which has a single writer)",
+        )
+
+    def handle(self, *args, **options):
+        if is_computed():
+            self.stdout.write("PRAYER_TIME_BACKEND is computed, prayer times aren't stored.")
+            return
+        days = options["days"]
+        if days is not None and not 0 < days <= MAX_PRAYER_DAYS:
+            raise CommandError("--days must be between 1 and %s." % MAX_PRAYER_DAYS)
+
+        mosques = Mosque.objects.order_by("id")
+        if options["mosque_ids"]:
+            mosques = mosques.filter(id__in=options["mosque_ids"])
+        if options["active"]:
+            mosques = mosques.filter(subscription_expiry__gte=now().date())
+        # The last day, or packed year, of each mosque is read from the end of
+        # its (mosque, date) index, so a run costs the new days only
+        packed = is_packed()
+        if packed:
+            last = PrayerYear.objects.filter(mosque=OuterRef("pk")).order_by("-year").values("year")
+        else:
+            last = PrayerTime.objects.filter(mosque=OuterRef("pk")).order_by("-date").values("date")
+        mosques = mosques.annotate(
+            days=Coalesce(F("configuration__prayer_duration_days"), DEFAULT_PRAYER_DAYS),
+            last=Subquery(last[:1]),
+        ).values_list("id", "latitude", "longitude", "days", "last")
+
+        # Mosques missing the same days are computed together, neighbours in
+        # the same task so they share their geo-grid schedule
+        mosques = sorted(mosques, key=lambda mosque: (round(mosque[1], 1), round(mosque[2], 1)))
+        today = now().date()
+        tasks = []
+        by_window = {}
+        up_to_date = 0
+        total = 0
+        for mosque_id, latitude, longitude, mosque_days, last in mosques:
+            end = today + timedelta(days=days or max(1, min(mosque_days, MAX_PRAYER_DAYS)))
+            if packed:
+                windows = packed_windows(today, end, last, options["full"])
+            else:
+                start = today
+                if not options["full"] and last is not None and last >= today:
+                    start = last + timedelta(days=1)
+                windows = [(start, (end - start).days)] if start < end else []
+            if not windows:
+                up_to_date += 1
+                continue
+            total += 1
+            for window in windows:
+                by_window.setdefault(window, []).append((mosque_id, latitude, longitude))
+        for (start, horizon), group in by_window.items():
+            for index in range(0, len(group), options["chunk_size"]):
+                tasks.append((group[index:index + options["chunk_size"]], start, horizon))
+        if not total:
+            self.stdout.write("All %d mosques are up to date." % up_to_date)
+            return
+
+        # Don't let forked workers inherit the database connections
+        connections.close_all()
+        started = time.perf_counter()
+        done = written = skipped = 0
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=setup_worker) as pool:
+            futures = {
+                pool.submit(
+                    compute_chunk, chunk, start, horizon, options["timezone"],
+                    options["batch_size"], options["write_in_workers"], packed,
+                ): (start, horizon)
+                for chunk, start, horizon in tasks
+            }
+            for future in as_completed(futures):
+                ids, result = future.result()
+                start, horizon = futures[future]
+                if options["write_in_workers"]:
+                    chunk_skipped = result
+                else:
+                    chunk_skipped = write_times(ids, result, start, horizon, options["batch_size"], packed)
+
+                done += 1
+                written += len(ids) * horizon - chunk_skipped
+                skipped += chunk_skipped
+                self.stdout.write("%d/%d tasks, %d days" % (done, len(tasks), written))
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            "Generated %d days for %d mosques in %.1fs (%.0f days/s, %.1f mosques/s), "
+            "%d up to date%s" % (
+                written, total, elapsed, written / elapsed, total / elapsed, up_to_date,
+                ", skipped %d days without sunrise or sunset" % skipped if skipped else "",
+            )
+        ))
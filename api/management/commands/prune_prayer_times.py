@@ -0,0 +1,149 @@
+import csv
+import gzip
+import json
+import tempfile
+import time
+from datetime import timedelta
+
+from auditlog.models import LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from api.models import PrayerTime
+from libs.prayer_engine import TIME_NAMES
+from libs.storage import ARCHIVE_STORAGE
+
+ARCHIVE_FIELDS = ("id", "mosque_id", "date", *TIME_NAMES, "created_at", "updated_at")
+LOG_ARCHIVE_FIELDS = (
+    "id", "content_type_id", "object_pk", "object_id", "object_repr", "action", "changes",
+    "actor_id", "cid", "remote_addr", "timestamp",
+)
+
+
+def keyset_batches(queryset, batch_size, fields=("id",)):
+    """
+    Yield the values of ``fields``, the first being the id, of the rows of a
+    queryset in batches of ``batch_size`` rows. Each batch starts after the
+    last id of the previous one, so it costs an index range scan however far
+    the job got, and no transaction is held in between.
+    """
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by("id").values_list(*fields)[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def archive_rows(queryset, name, batch_size, fields):
+    """
+    Write the ``fields`` of the rows of a queryset to a gzipped CSV in
+    ARCHIVE_STORAGE, JSON values encoded as JSON.
+
+    :return: The name of the archive, the number of rows and the last id
+        archived.
+    """
+    count = 0
+    last_id = None
+    with tempfile.TemporaryFile() as file:
+        with gzip.open(file, "wt", encoding="utf-8", newline="") as archive:
+            writer = csv.writer(archive)
+            writer.writerow(fields)
+            for rows in keyset_batches(queryset, batch_size, fields):
+                writer.writerows(
+                    [json.dumps(value) if isinstance(value, (dict, list)) else value for value in row]
+                    for row in rows
+                )
+                count += len(rows)
+                last_id = rows[-1][0]
+        if not count:
+            return None, 0, None
+        file.seek(0)
+        return ARCHIVE_STORAGE.save(name, File(file)), count, last_id
+
+
+def delete_ids(model, ids):
+    """
+    Delete rows of a model by id with a single DELETE, without collecting
+    related objects or sending the delete signals.
+
+    :return: The number of rows deleted.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM %s WHERE %s IN (%s)" % (
+                connection.ops.quote_name(model._meta.db_table),
+                connection.ops.quote_name(model._meta.pk.column),
+                ", ".join(["%s"] * len(ids)),
+            ),
+            ids,
+        )
+        return cursor.rowcount
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the prayer times of past days and their audit log entries in small "
+        "batches, optionally archiving both to gzipped CSVs first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-days", type=int, default=0,
+            help="Past days to keep before today (default: 0)",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows deleted per transaction")
+        parser.add_argument(
+            "--archive", action="store_true",
+            help="Save the rows and their audit log entries to the archive storage before deleting them",
+        )
+
+    def handle(self, *args, **options):
+        if options["keep_days"] < 0:
+            raise CommandError("--keep-days can't be negative.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive.")
+        cutoff = now().date() - timedelta(days=options["keep_days"])
+        past = PrayerTime.objects.filter(date__lt=cutoff)
+
+        content_type = ContentType.objects.get_for_model(PrayerTime)
+        if options["archive"]:
+            suffix = "before-%s-%s.csv.gz" % (cutoff.isoformat(), now().strftime("%Y%m%d%H%M%S"))
+            name, archived, last_id = archive_rows(
+                past, "prayer-times/" + suffix, options["batch_size"], ARCHIVE_FIELDS
+            )
+            if not archived:
+                self.stdout.write("No prayer times before %s." % cutoff)
+                return
+            self.stdout.write("Archived %d rows to %s" % (archived, name))
+            # Rows written after the archive aren't in it
+            past = past.filter(id__lte=last_id)
+
+            name, archived, _ = archive_rows(
+                LogEntry.objects.filter(content_type=content_type, object_id__in=past.values("id")),
+                "prayer-times/auditlog-" + suffix, options["batch_size"], LOG_ARCHIVE_FIELDS,
+            )
+            if archived:
+                self.stdout.write("Archived %d audit log entries to %s" % (archived, name))
+
+        started = time.perf_counter()
+        deleted = 0
+        for rows in keyset_batches(past, options["batch_size"]):
+            ids = [row[0] for row in rows]
+            with transaction.atomic():
+                # Past days aren't in any TV window and their deletion isn't
+                # worth an audit entry each, skip the post_delete receivers
+                deleted += delete_ids(PrayerTime, ids)
+                LogEntry.objects.filter(content_type=content_type, object_id__in=ids).delete()
+            self.stdout.write("%d rows deleted" % deleted)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            "Deleted %d prayer times before %s in %.1fs (%.0f rows/s)" % (
+                deleted, cutoff, elapsed, deleted / elapsed if elapsed else 0,
+            )
+        ))
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Mosque
+from api.publish import delete_replaced_snapshots, publish_snapshots
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Publish the TV content snapshots of the mosques whose content changed to file storage, "
+        "and delete the objects they replaced once their grace period is over."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mosque", type=int, action="append", dest="mosque_ids",
+            help="ID of a mosque to publish, may be repeated (default: all mosques)",
+        )
+        parser.add_argument(
+            "--every", type=float,
+            help="Keep publishing, every given number of seconds",
+        )
+
+    def handle(self, *args, **options):
+        if options["every"] is not None and options["every"] <= 0:
+            raise CommandError("--every must be positive.")
+        while True:
+            self.publish(options["mosque_ids"])
+            if options["every"] is None:
+                return
+            time.sleep(options["every"])
+
+    def publish(self, mosque_ids):
+        mosque_ids = mosque_ids or list(
+            Mosque.objects.order_by("id").values_list("id", flat=True)
+        )
+        started = time.perf_counter()
+        published = 0
+        for start in range(0, len(mosque_ids), BATCH_SIZE):
+            published += len(publish_snapshots(mosque_ids[start:start + BATCH_SIZE]))
+        deleted = delete_replaced_snapshots()
+
+        self.stdout.write(self.style.SUCCESS(
+            "Published %d of %d mosques in %.1fs, deleted %d replaced snapshots" % (
+                published, len(mosque_ids), time.perf_counter() - started, deleted
+            )
+        ))
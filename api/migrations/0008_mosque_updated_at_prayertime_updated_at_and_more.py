@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-17 11:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_masjidconfiguration_adzan_popup_duration_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mosque',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='prayertime',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='slider',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='textmarquee',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
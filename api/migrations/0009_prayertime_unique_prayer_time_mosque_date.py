@@ -0,0 +1,35 @@
+# Generated by Django 5.1.4 on 2026-10-17 11:33
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_prayer_times(apps, schema_editor):
+    """
+    Keep the first generated row of every (mosque, date) before it becomes unique.
+    """
+    PrayerTime = apps.get_model('api', 'PrayerTime')
+    duplicates = (
+        PrayerTime.objects.values('mosque_id', 'date')
+        .annotate(keep=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for row in duplicates.iterator():
+        PrayerTime.objects.filter(
+            mosque_id=row['mosque_id'], date=row['date']
+        ).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_mosque_updated_at_prayertime_updated_at_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_prayer_times, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='prayertime',
+            constraint=models.UniqueConstraint(fields=('mosque', 'date'), name='unique_prayer_time_mosque_date'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-17 11:39
+
+import django.core.files.storage
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_prayertime_unique_prayer_time_mosque_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishedSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField()),
+                ('day', models.DateField()),
+                ('file', models.FileField(max_length=300, storage=django.core.files.storage.FileSystemStorage(base_url='http://127.0.0.1:8000/static/upload/file/', location='/file'), upload_to='')),
+                ('published_at', models.DateTimeField(auto_now=True)),
+                ('mosque', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='published_snapshot', to='api.mosque')),
+            ],
+        ),
+    ]
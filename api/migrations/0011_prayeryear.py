@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-17 11:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_publishedsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrayerYear',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('minutes', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('mosque', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prayer_years', to='api.mosque')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('mosque', 'year'), name='unique_prayer_year_mosque_year')],
+            },
+        ),
+    ]
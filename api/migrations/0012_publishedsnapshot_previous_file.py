@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-17 12:24
+
+import django.core.files.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_prayeryear'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='publishedsnapshot',
+            name='previous_file',
+            field=models.FileField(blank=True, max_length=300, storage=django.core.files.storage.FileSystemStorage(base_url='http://127.0.0.1:8000/static/upload/file/', location='/file'), upload_to=''),
+        ),
+    ]
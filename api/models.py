@@ -1,11 +1,13 @@
 
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
-from libs.storage import FILE_STORAGE
+from libs.storage import SNAPSHOT_STORAGE
 from common.models import File
+from .snapshot import invalidate_tv_content
+from .device_cache import invalidate_device
 import datetime
 
 
@@ -45,6 +47,7 @@ class Mosque(models.Model):
     )
     subscription_expiry = models.DateField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def is_subscription_active(self):
         """
@@ -107,6 +110,7 @@ class Slider(models.Model):
     background_image = models.ForeignKey(File, on_delete=models.SET_NULL, blank=True, null=True)
     text = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Slider for {self.mosque.name}"
@@ -117,6 +121,7 @@ class TextMarquee(models.Model):
     mosque = models.ForeignKey(Mosque, on_delete=models.CASCADE, related_name="text_marquees")
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Text Marquee for {self.mosque.name}"
@@ -136,11 +141,36 @@ class PrayerTime(models.Model):
     isha = models.TimeField()
     midnight = models.TimeField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # One schedule per mosque per day, also the index TV windows scan
+            models.UniqueConstraint(fields=['mosque', 'date'], name='unique_prayer_time_mosque_date'),
+        ]
 
     def __str__(self):
         return f"{self.mosque} on {self.date}"
 
 
+# Packed Prayer Year Model
+class PrayerYear(models.Model):
+    mosque = models.ForeignKey(Mosque, on_delete=models.CASCADE, related_name="prayer_years")
+    year = models.PositiveSmallIntegerField()
+    # Minutes of the times of every day of the year, see api.packed_schedule
+    minutes = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mosque', 'year'], name='unique_prayer_year_mosque_year'),
+        ]
+
+    def __str__(self):
+        return f"{self.mosque} in {self.year}"
+
+
 # Masjid Configuration Model
 class MasjidConfiguration(models.Model):
     THEME_CHOICES = (
@@ -163,6 +193,19 @@ class MasjidConfiguration(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+# Published TV Content Snapshot Model
+class PublishedSnapshot(models.Model):
+    mosque = models.OneToOneField(Mosque, on_delete=models.CASCADE, related_name="published_snapshot")
+    version = models.BigIntegerField()  # Content version of the published snapshot
+    day = models.DateField()  # First day of the published prayer schedule
+    file = models.FileField(storage=SNAPSHOT_STORAGE, max_length=300)
+    published_at = models.DateTimeField(auto_now=True)
+    # Replaced object, kept for devices that still have its URL until deleted
+    previous_file = models.FileField(storage=SNAPSHOT_STORAGE, max_length=300, blank=True)
+
+    def __str__(self):
+        return f"{self.mosque} snapshot {self.version}"
+
 from auditlog.registry import auditlog
 
 # Register models for auditing
@@ -180,3 +223,44 @@ auditlog.register(MasjidConfiguration)
 def create_masjid_configuration(sender, instance, created, **kwargs):
     if created:
         MasjidConfiguration.objects.create(mosque=instance)
+
+
+@receiver([post_save, post_delete], sender=Slider)
+@receiver([post_save, post_delete], sender=TextMarquee)
+@receiver([post_save, post_delete], sender=PrayerTime)
+@receiver([post_save, post_delete], sender=PrayerYear)
+@receiver([post_save, post_delete], sender=MasjidConfiguration)
+def invalidate_mosque_tv_content(sender, instance, **kwargs):
+    invalidate_tv_content(instance.mosque_id)
+
+
+@receiver([post_save, post_delete], sender=Mosque)
+def invalidate_tv_content_of_mosque(sender, instance, **kwargs):
+    invalidate_tv_content(instance.pk)
+
+
+@receiver([post_save, pre_delete], sender=File)
+def invalidate_tv_content_of_slider_file(sender, instance, **kwargs):
+    # Sliders embed the url and size of their background image, and lose it
+    # through SET_NULL before post_delete would be sent
+    mosque_ids = Slider.objects.filter(
+        background_image_id=instance.pk
+    ).values_list('mosque_id', flat=True).distinct()
+    for mosque_id in mosque_ids:
+        invalidate_tv_content(mosque_id)
+
+
+@receiver(pre_save, sender=Device)
+def invalidate_previous_device_token(sender, instance, **kwargs):
+    if instance.pk is None:
+        return
+    previous_token = Device.objects.filter(pk=instance.pk).values_list(
+        'device_token', flat=True
+    ).first()
+    if previous_token and previous_token != instance.device_token:
+        invalidate_device(previous_token)
+
+
+@receiver([post_save, post_delete], sender=Device)
+def invalidate_device_token(sender, instance, **kwargs):
+    invalidate_device(instance.device_token)
@@ -0,0 +1,121 @@
+"""
+Packed prayer time storage.
+
+With ``PRAYER_TIME_BACKEND = "packed"`` prayer times are stored as one
+``PrayerYear`` row per mosque and year instead of one ``PrayerTime`` row per
+day: 365 times fewer rows and index entries, and none of them audited. The
+``minutes`` of a year hold, for every day from January 1st, the TIME_NAMES as
+little-endian ``uint16`` minutes since midnight, NO_TIME for a time that
+doesn't occur. A day is DAY_BYTES at a fixed offset, so a date range is read
+by slicing the bytes of its days and decoding only those.
+"""
+import calendar
+import sys
+from array import array
+from datetime import date, timedelta
+
+from libs.prayer_engine import TIME_NAMES
+from libs.prayertimes import TIME_OF_MINUTE
+from .computed_schedule import PRAYER_TIME_BACKEND
+
+NO_TIME = 0xFFFF
+DAY_BYTES = len(TIME_NAMES) * 2
+
+
+def is_packed():
+    return PRAYER_TIME_BACKEND == "packed"
+
+
+def year_days(year):
+    return 366 if calendar.isleap(year) else 365
+
+
+def pack_days(days):
+    """
+    Pack days of minutes since midnight, -1 for the times that don't occur.
+
+    :param days: One sequence of minutes in TIME_NAMES order per day.
+    """
+    values = array("H", (NO_TIME if minutes < 0 else minutes for day in days for minutes in day))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack_days(data, first, count):
+    """
+    Decode ``count`` days starting at day ``first`` of packed minutes.
+
+    :return: A tuple of minutes per day, None for days with a time that
+        doesn't occur or that aren't stored.
+    """
+    values = array("H")
+    values.frombytes(bytes(memoryview(data)[first * DAY_BYTES:(first + count) * DAY_BYTES]))
+    if sys.byteorder == "big":
+        values.byteswap()
+    size = len(TIME_NAMES)
+    days = [tuple(values[index:index + size]) for index in range(0, len(values), size)]
+    return [None if NO_TIME in day else day for day in days] + [None] * (count - len(days))
+
+
+def prayer_year_rows(ids, times, year):
+    """
+    Build the PrayerYear rows of fleet times computed over a whole year.
+
+    :return: The rows, and the number of days with a time that doesn't occur.
+    """
+    from .models import PrayerYear
+
+    rows = []
+    skipped = 0
+    for index, mosque_id in enumerate(ids):
+        days = list(zip(*(times[name][index] for name in TIME_NAMES)))
+        skipped += sum(1 for day in days if min(day) < 0)
+        rows.append(PrayerYear(mosque_id=mosque_id, year=year, minutes=pack_days(days)))
+    return rows, skipped
+
+
+def upsert_prayer_years(prayer_years, batch_size=None):
+    """
+    Insert PrayerYear rows, replacing the years of a mosque stored already,
+    and refresh the TV content of their mosques.
+    """
+    from .models import PrayerYear
+    from .snapshot import invalidate_tv_content
+
+    PrayerYear.objects.bulk_create(
+        prayer_years, batch_size=batch_size, update_conflicts=True,
+        unique_fields=['mosque', 'year'], update_fields=['minutes', 'updated_at'],
+    )
+    # bulk_create doesn't send post_save, refresh the TV content ourselves
+    for mosque_id in {prayer_year.mosque_id for prayer_year in prayer_years}:
+        invalidate_tv_content(mosque_id)
+
+
+def packed_prayer_schedule(mosque_id, day, days):
+    """
+    Read the prayer times of the ``days`` days starting at ``day`` from the
+    mosque's PrayerYear rows as unsaved PrayerTime instances, leaving out the
+    days that aren't stored like the rows would be missing. Their
+    ``updated_at`` is the one of their year.
+    """
+    from .models import PrayerTime, PrayerYear
+
+    last = day + timedelta(days=days - 1)
+    prayer_times = []
+    for prayer_year in PrayerYear.objects.filter(
+        mosque_id=mosque_id, year__gte=day.year, year__lte=last.year
+    ).order_by("year"):
+        start = max(day, date(prayer_year.year, 1, 1))
+        end = min(last, date(prayer_year.year, 12, 31))
+        first = start.timetuple().tm_yday - 1
+        count = (end - start).days + 1
+        for offset, minutes in enumerate(unpack_days(prayer_year.minutes, first, count)):
+            if minutes is None:
+                continue
+            prayer_times.append(PrayerTime(
+                mosque_id=mosque_id, date=start + timedelta(days=offset),
+                updated_at=prayer_year.updated_at,
+                **{name: TIME_OF_MINUTE[minute] for name, minute in zip(TIME_NAMES, minutes)}
+            ))
+    return prayer_times
@@ -0,0 +1,140 @@
+"""
+Current and next prayer state of a mosque.
+
+The prayers of a mosque from yesterday to tomorrow are turned once into a
+sorted timeline of phases: ``adzan`` from a prayer's time for the
+configured ``adzan_popup_duration``, then ``iqomah`` (or ``khutbah`` before
+the Friday dhuhr) and ``idle`` until the next prayer. The timeline is cached
+with the mosque's content version, and the phase at a given moment and the
+next prayer are found by bisecting it, so devices can poll the state instead
+of deriving it from the whole schedule.
+"""
+import math
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+
+from django.utils.timezone import now
+
+from .computed_schedule import PRAYER_TIME_TIMEZONE
+from .snapshot import get_cache, get_content_version, prayer_schedule, SNAPSHOT_TIMEOUT
+
+PRAYER_NAMES = ('fajr', 'dhuhr', 'asr', 'maghrib', 'isha')
+
+# Prayer times are stored in the local time of the deployment
+LOCAL_TIMEZONE = timezone(timedelta(hours=PRAYER_TIME_TIMEZONE))
+
+FRIDAY = 4
+
+
+def timeline_key(mosque_id, day, version):
+    return "prayer-state:timeline:%s:%s:%s" % (mosque_id, day.isoformat(), version)
+
+
+def build_timeline(mosque, day):
+    """
+    Build the timeline of a mosque around ``day``.
+
+    :return: A dictionary of the sorted ``starts`` of the phases as POSIX
+        timestamps with their ``(phase, prayer)`` as ``events``, and the
+        sorted ``prayers`` timestamps with their ``names``.
+    """
+    from .models import MasjidConfiguration
+
+    try:
+        configuration = mosque.configuration
+    except MasjidConfiguration.DoesNotExist:
+        # Without a configuration of its own the defaults apply
+        configuration = MasjidConfiguration(mosque=mosque)
+    prayers = sorted(
+        (datetime.combine(prayer_time.date, getattr(prayer_time, name), LOCAL_TIMEZONE).timestamp(), name)
+        for prayer_time in prayer_schedule(mosque, day - timedelta(days=1), 3)
+        for name in PRAYER_NAMES
+    )
+
+    starts = []
+    events = []
+    for index, (at, name) in enumerate(prayers):
+        until = prayers[index + 1][0] if index + 1 < len(prayers) else math.inf
+        friday = datetime.fromtimestamp(at, LOCAL_TIMEZONE).weekday() == FRIDAY
+        phases = (
+            ('adzan', configuration.adzan_popup_duration),
+            ('khutbah', configuration.khutbah_popup_duration) if friday and name == 'dhuhr'
+            else ('iqomah', configuration.iqomah_popup_duration),
+            ('idle', math.inf),
+        )
+        for phase, duration in phases:
+            if at >= until:
+                break
+            if duration:
+                starts.append(at)
+                events.append((phase, name))
+                at += duration
+    return {
+        "starts": starts,
+        "events": events,
+        "prayers": [at for at, _ in prayers],
+        "names": [name for _, name in prayers],
+    }
+
+
+def get_timeline(mosque_id, day):
+    """
+    Return the timeline of a mosque around ``day``, cached until the
+    mosque's content changes.
+    """
+    from .models import Mosque
+
+    cache = get_cache()
+    key = timeline_key(mosque_id, day, get_content_version(mosque_id))
+    timeline = cache.get(key)
+    if timeline is None:
+        mosque = Mosque.objects.select_related("configuration").get(pk=mosque_id)
+        timeline = build_timeline(mosque, day)
+        cache.set(key, timeline, SNAPSHOT_TIMEOUT)
+    return timeline
+
+
+def timestamp_isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp, LOCAL_TIMEZONE).isoformat()
+
+
+def prayer_state(timeline, at):
+    """
+    Return the phase of a timeline at POSIX timestamp ``at``, the prayer it
+    belongs to, and when the phase and the next prayer start.
+    """
+    index = bisect_right(timeline["starts"], at) - 1
+    phase, prayer = timeline["events"][index] if index >= 0 else ('idle', None)
+    state = {
+        "phase": phase,
+        "prayer": prayer,
+        "transition_at": None,
+        "seconds_to_transition": None,
+        "next_prayer": None,
+        "next_prayer_at": None,
+        "seconds_to_next_prayer": None,
+    }
+    if index + 1 < len(timeline["starts"]):
+        transition = timeline["starts"][index + 1]
+        state["transition_at"] = timestamp_isoformat(transition)
+        state["seconds_to_transition"] = math.ceil(transition - at)
+
+    upcoming = bisect_right(timeline["prayers"], at)
+    if upcoming < len(timeline["prayers"]):
+        next_at = timeline["prayers"][upcoming]
+        state["next_prayer"] = timeline["names"][upcoming]
+        state["next_prayer_at"] = timestamp_isoformat(next_at)
+        state["seconds_to_next_prayer"] = math.ceil(next_at - at)
+    return state
+
+
+def get_prayer_state(mosque_id):
+    """
+    Return the current prayer state of a mosque.
+    """
+    current = now()
+    timeline = get_timeline(mosque_id, current.astimezone(LOCAL_TIMEZONE).date())
+    return {
+        "server_time": current.astimezone(LOCAL_TIMEZONE).isoformat(),
+        **prayer_state(timeline, current.timestamp()),
+    }
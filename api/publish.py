@@ -0,0 +1,163 @@
+"""
+Publishing of TV content snapshots as static files.
+
+Each mosque's current snapshot is written to ``SNAPSHOT_STORAGE`` (S3 or the
+local file system, see ``libs.storage``) under a name holding its day and
+content version, so the object never changes once written and is served with
+a Cache-Control that lets a CDN cache it for as long as it likes. Devices ask the app for the current URL only, and
+mosques whose content and day didn't change since the last publication aren't
+written again.
+
+Snapshots are only published by the ``publish_tv_content`` command, never on
+a device request. Each one is written under a name of its own, and the
+mosque's row is only locked to point it at the new object. The replaced
+object is kept for ``PUBLISH_GRACE`` seconds, so devices that got its URL
+just before can still fetch it. Pointers are cached by object name, URLs are
+signed on each request since they expire long before the pointer does.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils.timezone import now
+
+from libs.storage import SNAPSHOT_STORAGE
+from .models import Mosque, PublishedSnapshot
+from .snapshot import get_cache, get_tv_content, get_content_versions, SNAPSHOT_TIMEOUT
+
+PUBLISH_GRACE = getattr(settings, "TV_CONTENT_PUBLISH_GRACE", 60 * 60)
+
+
+def snapshot_name(mosque_id, version, day):
+    # Unique, so concurrent publishers of a version never write the same object
+    return "tv-content/%s/%s-%s-%s.json" % (
+        mosque_id, day.strftime("%Y%m%d"), version, uuid.uuid4().hex[:8]
+    )
+
+
+def published_key(mosque_id):
+    return "tv-content:published-name:%s" % mosque_id
+
+
+def is_current(published, version, day):
+    return published is not None and published["version"] == version and published["day"] == day
+
+
+def snapshot_pointer(published):
+    return {"version": published.version, "day": published.day, "name": published.file.name}
+
+
+def pointer_url(pointer):
+    return {
+        "version": pointer["version"],
+        "day": pointer["day"],
+        "url": SNAPSHOT_STORAGE.url(pointer["name"]),
+    }
+
+
+def publish_snapshot(mosque_id, day=None):
+    """
+    Write the current snapshot of a mosque to storage, replacing the
+    previously published one unless it is current already. The object is
+    written first, then the mosque's row is locked to point at it, unless a
+    concurrent publisher got the same or a later version in first, in which
+    case the object is deleted again.
+
+    :return: A dict of the published ``version``, ``day`` and ``url``.
+    """
+    day = day or now().date()
+    snapshot = get_tv_content(mosque_id, day)
+    version = snapshot["version"]
+    published = PublishedSnapshot.objects.filter(mosque_id=mosque_id).first()
+    if published is None or (published.day, published.version) != (day, version):
+        name = SNAPSHOT_STORAGE.save(snapshot_name(mosque_id, version, day), ContentFile(snapshot["body"]))
+        stale = None
+        try:
+            with transaction.atomic():
+                Mosque.objects.select_for_update().only("id").get(pk=mosque_id)
+                published = (
+                    PublishedSnapshot.objects.filter(mosque_id=mosque_id).first()
+                    or PublishedSnapshot(mosque_id=mosque_id)
+                )
+                swapped = published.pk is None or (published.day, published.version) < (day, version)
+                if swapped:
+                    # Two publications ago, its grace ends early
+                    stale = published.previous_file.name
+                    published.previous_file = published.file.name or ""
+                    published.version = version
+                    published.day = day
+                    published.file = name
+                    published.save()
+        except BaseException:
+            # Don't leave an object no row points at
+            SNAPSHOT_STORAGE.delete(name)
+            raise
+        if not swapped:
+            SNAPSHOT_STORAGE.delete(name)
+        elif stale:
+            SNAPSHOT_STORAGE.delete(stale)
+
+    pointer = snapshot_pointer(published)
+    get_cache().set(published_key(mosque_id), pointer, SNAPSHOT_TIMEOUT)
+    return pointer_url(pointer)
+
+
+def get_published_snapshot(mosque_id):
+    """
+    Return the pointer to the published snapshot of a mosque, or None when
+    none was published yet.
+    """
+    cache = get_cache()
+    pointer = cache.get(published_key(mosque_id))
+    if pointer is None:
+        published = PublishedSnapshot.objects.filter(mosque_id=mosque_id).first()
+        if published is None:
+            return None
+        pointer = snapshot_pointer(published)
+        cache.set(published_key(mosque_id), pointer, SNAPSHOT_TIMEOUT)
+    return pointer_url(pointer)
+
+
+def publish_snapshots(mosque_ids):
+    """
+    Publish the snapshots of the given mosques whose content or day changed
+    since their last publication.
+
+    :return: The ids of the mosques that were published.
+    """
+    day = now().date()
+    versions = get_content_versions(mosque_ids)
+    published = {
+        mosque_id: {"version": version, "day": published_day}
+        for mosque_id, version, published_day in PublishedSnapshot.objects.filter(
+            mosque_id__in=mosque_ids
+        ).values_list("mosque_id", "version", "day")
+    }
+    changed = [
+        mosque_id for mosque_id in mosque_ids
+        if not is_current(published.get(mosque_id), versions[mosque_id], day)
+    ]
+    for mosque_id in changed:
+        publish_snapshot(mosque_id, day)
+    return changed
+
+
+def delete_replaced_snapshots(grace=PUBLISH_GRACE):
+    """
+    Delete the replaced objects of the snapshots published more than
+    ``grace`` seconds ago.
+
+    :return: The number of objects deleted.
+    """
+    replaced = PublishedSnapshot.objects.filter(
+        published_at__lt=now() - timedelta(seconds=grace)
+    ).exclude(previous_file="")
+    count = 0
+    for published in replaced.only("id", "previous_file"):
+        SNAPSHOT_STORAGE.delete(published.previous_file.name)
+        # Without touching published_at
+        PublishedSnapshot.objects.filter(pk=published.pk).update(previous_file="")
+        count += 1
+    return count
@@ -0,0 +1,82 @@
+"""
+Change notifications for the TV content of mosques, for the ASGI server.
+
+A single task per process polls the content versions of every mosque that has
+a connected device, with one ``get_many`` on the snapshot cache per interval,
+and wakes the connections of the mosques whose version moved. An idle
+connection therefore costs a coroutine and an ``asyncio.Event``, not a worker.
+"""
+import asyncio
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .snapshot import get_content_versions
+
+POLL_INTERVAL = getattr(settings, "TV_PUSH_POLL_INTERVAL", 2)
+HEARTBEAT_INTERVAL = getattr(settings, "TV_PUSH_HEARTBEAT_INTERVAL", 25)
+
+
+class ContentVersionWatcher:
+    """
+    Watch the content versions of the mosques that have subscribers.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.subscribers = Counter()
+        self.versions = {}
+        self.events = {}
+        self.task = None
+
+    async def wait_for_change(self, mosque_id, version, timeout):
+        """
+        Wait until the content version of the mosque differs from ``version``.
+
+        :return: The new version, or None if ``timeout`` seconds passed first.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.subscribers[mosque_id] += 1
+        self.start()
+        try:
+            while True:
+                current = self.versions.get(mosque_id)
+                if current is not None and current != version:
+                    return current
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                event = self.events.setdefault(mosque_id, asyncio.Event())
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return None
+        finally:
+            self.subscribers[mosque_id] -= 1
+            if not self.subscribers[mosque_id]:
+                del self.subscribers[mosque_id]
+                self.versions.pop(mosque_id, None)
+                self.events.pop(mosque_id, None)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while self.subscribers:
+            versions = await sync_to_async(get_content_versions, thread_sensitive=False)(
+                list(self.subscribers)
+            )
+            for mosque_id, version in versions.items():
+                if mosque_id not in self.subscribers or self.versions.get(mosque_id) == version:
+                    continue
+                self.versions[mosque_id] = version
+                event = self.events.pop(mosque_id, None)
+                if event is not None:
+                    event.set()
+            await asyncio.sleep(self.interval)
+
+
+watcher = ContentVersionWatcher()
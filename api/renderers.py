@@ -0,0 +1,22 @@
+from rest_framework.renderers import BaseRenderer
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renders data as MessagePack, for devices that ask for
+    ``application/msgpack`` or ``?format=msgpack``.
+    """
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, use_bin_type=True)
@@ -0,0 +1,285 @@
+"""
+Per-mosque snapshot of the TV content payload.
+
+Every TV of a mosque polls the same payload, so the serialized content is kept
+in a shared cache and only rebuilt after one of the rows it is made of changes.
+The receivers in ``api.models`` bump the mosque's content version on commit,
+which makes the cached snapshot stale without touching it.
+"""
+import gzip
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.timezone import now
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+TV_CONTENT_CACHE = getattr(settings, "TV_CONTENT_CACHE", "tv_content")
+SNAPSHOT_TIMEOUT = getattr(settings, "TV_CONTENT_SNAPSHOT_TIMEOUT", 60 * 60 * 24)
+
+# Number of prayer days sent to TVs when neither the request nor the
+# mosque's configuration sets it, and the most a request may ask for
+DEFAULT_PRAYER_DAYS = 30
+MAX_PRAYER_DAYS = 366
+
+# Rows are stamped before their transaction commits and the version is bumped
+# after it, so deltas look this much further back than the version itself
+DELTA_OVERLAP = timedelta(seconds=getattr(settings, "TV_CONTENT_DELTA_OVERLAP", 5))
+
+
+def get_cache():
+    return caches[TV_CONTENT_CACHE]
+
+
+def version_key(mosque_id):
+    return "tv-content:version:%s" % mosque_id
+
+
+def snapshot_key(mosque_id, day, days=None):
+    return "tv-content:snapshot:%s:%s:%s" % (mosque_id, day.isoformat(), days or "")
+
+
+def prayer_window_days(duration_days, days=None):
+    """
+    Number of prayer days to send, defaulting to the ``prayer_duration_days``
+    configured for the mosque.
+    """
+    if days is None:
+        days = duration_days or DEFAULT_PRAYER_DAYS
+    return max(1, min(days, MAX_PRAYER_DAYS))
+
+
+def prayer_schedule_window(mosque_id, day, days):
+    """
+    Prayer times of the ``days`` days starting at ``day``, a range scan of
+    the (mosque, date) unique index.
+    """
+    from .models import PrayerTime
+
+    return PrayerTime.objects.filter(
+        mosque_id=mosque_id, date__gte=day, date__lt=day + timedelta(days=days)
+    ).order_by("date")
+
+
+def prayer_schedule(mosque, day, days):
+    """
+    Prayer times of the ``days`` days starting at ``day`` from the
+    deployment's PRAYER_TIME_BACKEND, stored rows, computed or packed ones.
+    """
+    from .computed_schedule import is_computed, computed_prayer_schedule
+    from .packed_schedule import is_packed, packed_prayer_schedule
+
+    if is_computed():
+        return computed_prayer_schedule(mosque.pk, mosque.latitude, mosque.longitude, day, days)
+    if is_packed():
+        return packed_prayer_schedule(mosque.pk, day, days)
+    return prayer_schedule_window(mosque.pk, day, days)
+
+
+def new_version():
+    """
+    Versions are microsecond timestamps, so a version that got evicted from
+    the cache is re-created greater than every version handed out before.
+    """
+    return time.time_ns() // 1000
+
+
+def get_content_version(mosque_id):
+    """
+    Return the current content version of a mosque, creating it if needed.
+    """
+    cache = get_cache()
+    key = version_key(mosque_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_content_versions(mosque_ids):
+    """
+    Return a dict of the current content versions of several mosques.
+    """
+    keys = {version_key(mosque_id): mosque_id for mosque_id in mosque_ids}
+    versions = {keys[key]: version for key, version in get_cache().get_many(keys).items()}
+    for mosque_id in mosque_ids:
+        if mosque_id not in versions:
+            versions[mosque_id] = get_content_version(mosque_id)
+    return versions
+
+
+def resync_key(mosque_id):
+    return "tv-content:resync:%s" % mosque_id
+
+
+def bump_content_version(mosque_id):
+    version = new_version()
+    get_cache().set(version_key(mosque_id), version, None)
+    return version
+
+
+def commit_content_change(mosque_id, stamped):
+    """
+    Bump the content version of a mosque once a change stamped at version
+    ``stamped`` committed. When that took longer than DELTA_OVERLAP, a delta
+    since a version handed out meanwhile would miss the change, so devices
+    holding one of them are marked for a full re-sync.
+    """
+    version = bump_content_version(mosque_id)
+    if version - stamped <= DELTA_OVERLAP // timedelta(microseconds=1):
+        return
+    cache = get_cache()
+    resync = cache.get(resync_key(mosque_id))
+    if resync is not None and resync[1] >= stamped:
+        stamped = min(stamped, resync[0])
+    cache.set(resync_key(mosque_id), (stamped, version), None)
+
+
+def needs_full_sync(mosque_id, since):
+    """
+    Whether a delta since content version ``since`` could miss a change that
+    committed long after it was made.
+    """
+    resync = get_cache().get(resync_key(mosque_id))
+    return resync is not None and resync[0] <= since < resync[1]
+
+
+def invalidate_tv_content(mosque_id):
+    """
+    Mark the TV content of a mosque as changed once the current transaction
+    commits, so a concurrent rebuild can't cache rows that are rolled back
+    or not yet visible.
+    """
+    stamped = new_version()
+    transaction.on_commit(lambda: commit_content_change(mosque_id, stamped))
+
+
+def build_tv_content(mosque_id, day, days=None):
+    """
+    Query and serialize the TV content of a mosque, with the prayer schedule
+    of ``days`` days starting at ``day``.
+    """
+    from .models import Mosque, Slider, TextMarquee, MasjidConfiguration
+    from .serializers import TVContentSerializer
+
+    mosque = Mosque.objects.get(pk=mosque_id)
+    configurations = MasjidConfiguration.objects.filter(mosque=mosque).first()
+    days = prayer_window_days(configurations and configurations.prayer_duration_days, days)
+    sliders = Slider.objects.filter(mosque=mosque)
+    text_marquee = TextMarquee.objects.filter(mosque=mosque)
+
+    serializer = TVContentSerializer({
+        "mosque": mosque,
+        "prayer_schedule": prayer_schedule(mosque, day, days),
+        "sliders": sliders,
+        "text_marquee": text_marquee,
+        "configurations": configurations
+    })
+    return serializer.data
+
+
+def content_etag(mosque_id, version, day, days=None, format="json"):
+    """
+    Weak entity tag of the TV content of a mosque at ``version`` on ``day``.
+    """
+    return 'W/"%s-%s-%s-%s-%s"' % (mosque_id, version, day.strftime("%Y%m%d"), days or "", format)
+
+
+def render_tv_content(mosque_id, day, days=None):
+    """
+    Return the TV content data of a mosque and its rendered JSON, through
+    the hot-path encoder unless it can't reproduce the serializer's output.
+    """
+    from .encoders import tv_content_data, render_json, UnsupportedContent
+
+    try:
+        data = tv_content_data(mosque_id, day, days)
+        return data, render_json(data)
+    except UnsupportedContent:
+        data = build_tv_content(mosque_id, day, days)
+        return data, JSONRenderer().render(data)
+
+
+def build_snapshot(version, data, body):
+    """
+    Keep the rendered TV content along with its gzip and (when the brotli
+    package is installed) brotli encodings, so requests only have to pick
+    the stored bytes for their Accept-Encoding, and its compact MessagePack
+    rendering when the msgpack package is installed.
+    """
+    from .encoders import render_msgpack
+
+    encodings = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encodings["br"] = brotli.compress(body, quality=11)
+    return {
+        "version": version,
+        "data": data,
+        "body": body,
+        "encodings": encodings,
+        "msgpack": render_msgpack(data),
+    }
+
+
+def negotiate_encoding(snapshot, accept_encoding):
+    """
+    Pick the stored encoding of a snapshot preferred by an Accept-Encoding
+    header.
+
+    :return: A tuple of the content coding (None for identity) and the body.
+    """
+    preferences = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        preferences[coding.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for coding in ("br", "gzip"):
+        quality = preferences.get(coding, preferences.get("*", 0.0))
+        if coding in snapshot["encodings"] and quality > best_quality:
+            best, best_quality = coding, quality
+    if best is None:
+        return None, snapshot["body"]
+    return best, snapshot["encodings"][best]
+
+
+def get_tv_content(mosque_id, day=None, days=None):
+    """
+    Return the snapshot of the TV content of a mosque, rebuilding it if its
+    version is behind the mosque's. The snapshot is a dict of the content
+    ``version``, the serialized ``data``, its rendered JSON ``body`` and the
+    compressed ``encodings`` of the body.
+
+    A hit costs a single ``get_many`` round trip to the cache.
+    """
+    cache = get_cache()
+    day = day or now().date()
+    v_key = version_key(mosque_id)
+    s_key = snapshot_key(mosque_id, day, days)
+
+    cached = cache.get_many([v_key, s_key])
+    version = cached.get(v_key)
+    snapshot = cached.get(s_key)
+    if version is not None and snapshot is not None and snapshot["version"] == version:
+        return snapshot
+
+    if version is None:
+        version = get_content_version(mosque_id)
+    snapshot = build_snapshot(version, *render_tv_content(mosque_id, day, days))
+    cache.set(s_key, snapshot, SNAPSHOT_TIMEOUT)
+    return snapshot
@@ -1,9 +1,40 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import zipfile
+from unittest import mock
+import msgpack
+import numpy
 import requests
 from rest_framework.test import APITestCase
 from rest_framework import status
-from datetime import timedelta
+from datetime import date, datetime, timedelta
+from auditlog.models import LogEntry
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.utils.timezone import now
-from .models import Mosque, Subscription, MosqueUser, Slider, TextMarquee, Device, MasjidConfiguration, User
+from .models import Mosque, Subscription, MosqueUser, Slider, TextMarquee, Device, MasjidConfiguration, User, PrayerTime, PrayerYear, PublishedSnapshot
+from .heartbeat import HeartbeatBuffer
+from .device_cache import UnknownDeviceThrottle, device_key
+from .encoders import tv_content_data, render_json
+from .snapshot import build_tv_content, bump_content_version
+from .push import ContentVersionWatcher
+from .views.push import content_events
+from .publish import delete_replaced_snapshots, publish_snapshot, publish_snapshots
+from .computed_schedule import ScheduleLRU, schedules
+from .packed_schedule import pack_days, unpack_days, packed_prayer_schedule
+from .admin import PrayerYearAdmin
+from django.contrib import admin
+from common.models import File
+from common.testing import TemporaryStorageMixin
+from libs.storage import ARCHIVE_STORAGE, FILE_STORAGE, STORAGE_BUNDLE
+from libs.prayertimes import ShalatSchedule
+from libs import prayer_engine, prayertimes, schedule_grid
+from rest_framework.renderers import JSONRenderer
 
 class MasjidDisplayServiceTests(APITestCase):
     @classmethod
@@ -127,3 +158,832 @@ class MasjidDisplayServiceTests(APITestCase):
         response = self.client.get("/api/subscriptions/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn("Basic Plan", str(response.data))
+
+
+TEST_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "tv_content": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "prayer_schedule": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "devices": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "devices"},
+    "unknown_devices": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "unknown"},
+}
+
+
+def create_mosque():
+    return Mosque.objects.create(
+        name="Istiqlal", address="Jakarta", latitude=-6.170167, longitude=106.831382
+    )
+
+
+class MosqueTestMixin:
+    """
+    Empties the test caches and creates ``self.mosque``, with a device of
+    token ``device_token`` as ``self.device`` when it is set.
+    """
+    device_token = None
+
+    def setUp(self):
+        super().setUp()
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+        self.mosque = create_mosque()
+        if self.device_token:
+            self.device = Device.objects.create(
+                mosque=self.mosque, name="Main Hall Display", device_token=self.device_token
+            )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TVContentSnapshotTests(MosqueTestMixin, APITestCase):
+    device_token = "sample-device-token"
+
+    def setUp(self):
+        super().setUp()
+        self.slider = Slider.objects.create(mosque=self.mosque, text="Welcome to the Mosque")
+        self.url = "/api/device/tv-content/?uuid=sample-device-token"
+
+    def test_snapshot_is_served_from_cache(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Neither the device nor the content hit the database once cached
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.content, response.content)
+
+    def test_snapshot_is_invalidated_on_change(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.slider.text = "Ramadan Mubarak"
+            self.slider.save()
+            TextMarquee.objects.create(mosque=self.mosque, text="Upcoming Events")
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()["sliders"][0]["text"], "Ramadan Mubarak")
+        self.assertEqual(response.json()["text_marquee"][0]["text"], "Upcoming Events")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.slider.delete()
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()["sliders"], [])
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TextMarquee.objects.create(mosque=self.mosque, text="Upcoming Events")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_precompressed_content(self):
+        plain = self.client.get(self.url)
+        self.assertNotIn("Content-Encoding", plain)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(json.loads(plain.content)["sliders"][0]["text"], "Welcome to the Mosque")
+
+    def test_msgpack_content(self):
+        PrayerTime.objects.create(
+            mosque=self.mosque, date=now().date(),
+            imsak="04:20", fajr="04:30", sunrise="05:45", dhuhr="11:55", asr="15:15",
+            sunset="17:55", maghrib="18:00", isha="19:10", midnight="23:50",
+        )
+        plain = self.client.get(self.url).json()
+        response = self.client.get(self.url, HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        data = msgpack.unpackb(response.content)
+        self.assertEqual(data["sliders"], plain["sliders"])
+        self.assertEqual(data["prayer_schedule"]["fajr"], [4 * 60 + 30])
+        self.assertEqual(data["prayer_schedule"]["date"], [(now().date() - date(1970, 1, 1)).days])
+
+        etag = response["ETag"]
+        self.assertEqual(
+            self.client.get(self.url, HTTP_ACCEPT="application/msgpack", HTTP_IF_NONE_MATCH=etag).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_delta_since_version(self):
+        marquee = TextMarquee.objects.create(mosque=self.mosque, text="Upcoming Events")
+        response = self.client.get(self.url)
+        version = int(response["X-Content-Version"])
+        # Age the content the device already has past the delta overlap
+        an_hour_ago = now() - timedelta(hours=1)
+        Mosque.objects.filter(pk=self.mosque.pk).update(updated_at=an_hour_ago)
+        Slider.objects.filter(mosque=self.mosque).update(updated_at=an_hour_ago)
+        TextMarquee.objects.filter(mosque=self.mosque).update(updated_at=an_hour_ago)
+        MasjidConfiguration.objects.filter(mosque=self.mosque).update(updated_at=an_hour_ago)
+
+        response = self.client.get(f"{self.url}&since={version}")
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        marquee_id = marquee.id
+        with self.captureOnCommitCallbacks(execute=True):
+            new_slider = Slider.objects.create(mosque=self.mosque, text="Ramadan Mubarak")
+            marquee.delete()
+        response = self.client.get(f"{self.url}&since={version}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(response.data["version"], version)
+        self.assertNotIn("mosque", response.data)
+        self.assertNotIn("configurations", response.data)
+        self.assertEqual([s["id"] for s in response.data["sliders"]], [new_slider.id])
+        self.assertEqual(response.data["text_marquee"], [])
+        self.assertEqual(response.data["deleted"]["text_marquee"], [marquee_id])
+
+    def test_since_must_be_a_content_version(self):
+        for since in ("abc", "-1", str(10 ** 30)):
+            response = self.client.get(f"{self.url}&since={since}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_full_content_after_a_late_commit(self):
+        # A long transaction: its rows are stamped well before it commits
+        long_ago = now() - timedelta(minutes=10)
+        stamped = int(long_ago.timestamp() * 1_000_000)
+        before = stamped - 60 * 1_000_000
+        with self.captureOnCommitCallbacks() as callbacks:
+            with mock.patch("api.snapshot.new_version", return_value=stamped):
+                Slider.objects.create(mosque=self.mosque, text="Ramadan Mubarak")
+            Slider.objects.filter(mosque=self.mosque).update(updated_at=long_ago)
+            meanwhile = bump_content_version(self.mosque.pk)
+        with mock.patch("api.snapshot.new_version", return_value=meanwhile + 60 * 1_000_000):
+            for callback in callbacks:
+                callback()
+
+        response = self.client.get(f"{self.url}&since={meanwhile}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("since", response.json())
+        self.assertIn("Ramadan Mubarak", [slider["text"] for slider in response.json()["sliders"]])
+        # Versions from before the change can't have missed it
+        response = self.client.get(f"{self.url}&since={before}")
+        self.assertEqual(response.data["since"], before)
+        self.assertIn("Ramadan Mubarak", [slider["text"] for slider in response.data["sliders"]])
+        self.assertEqual(
+            self.client.get(f"{self.url}&since={meanwhile + 60 * 1_000_000}").status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+
+    def test_prayer_schedule_window(self):
+        today = now().date()
+        PrayerTime.objects.bulk_create([
+            PrayerTime(
+                mosque=self.mosque, date=today + timedelta(days=offset),
+                imsak="04:20", fajr="04:30", sunrise="05:45", dhuhr="11:55", asr="15:15",
+                sunset="17:55", maghrib="18:00", isha="19:10", midnight="23:50",
+            )
+            for offset in range(45, -2, -1)
+        ])
+        MasjidConfiguration.objects.filter(mosque=self.mosque).update(prayer_duration_days=7)
+
+        response = self.client.get(self.url)
+        dates = [day["date"] for day in response.json()["prayer_schedule"]]
+        self.assertEqual(dates, [(today + timedelta(days=offset)).isoformat() for offset in range(7)])
+
+        response = self.client.get(f"{self.url}&days=3")
+        self.assertEqual(len(response.json()["prayer_schedule"]), 3)
+
+        response = self.client.get(f"{self.url}&days=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_heartbeats_are_written_in_batches(self):
+        buffer = HeartbeatBuffer(interval=None, enabled=True)
+        with mock.patch("api.views.tv.heartbeats", buffer):
+            self.client.get(self.url)
+        self.device.refresh_from_db()
+        self.assertIsNone(self.device.last_synced_at)
+
+        self.assertEqual(buffer.flush(), 1)
+        self.device.refresh_from_db()
+        self.assertIsNotNone(self.device.last_synced_at)
+
+    def test_unknown_device(self):
+        response = self.client.get("/api/device/tv-content/?uuid=unknown")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/device/tv-content/?uuid=unknown")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Device.objects.create(mosque=self.mosque, name="Lobby Display", device_token="unknown")
+        response = self.client.get("/api/device/tv-content/?uuid=unknown")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_unknown_devices_are_cached_apart_and_throttled(self):
+        self.client.get(self.url)
+        with mock.patch.object(UnknownDeviceThrottle, "THROTTLE_RATES", {"unknown_device": "2/min"}):
+            for token in ("scan-1", "scan-2"):
+                response = self.client.get("/api/device/tv-content/?uuid=%s" % token)
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            response = self.client.get("/api/device/tv-content/?uuid=scan-3")
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn("Retry-After", response)
+            # Other clients aren't throttled
+            response = self.client.get(
+                "/api/device/tv-content/?uuid=scan-3", HTTP_X_FORWARDED_FOR="10.0.0.2"
+            )
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            # Cached answers are still given
+            response = self.client.get("/api/device/tv-content/?uuid=scan-1")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        self.assertIsNone(caches["devices"].get(device_key("scan-1")))
+        self.assertTrue(caches["unknown_devices"].get(device_key("scan-1")))
+
+    def test_inactive_device(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.is_active = False
+            self.device.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TVContentEncoderTests(TemporaryStorageMixin, TestCase):
+    temporary_storages = (FILE_STORAGE,)
+
+    def setUp(self):
+        super().setUp()
+        self.mosque = Mosque.objects.create(
+            name='Masjid "Al-Ikhlas" \u2028 \u0645\u0633\u062c\u062f',
+            address="Jl. Merdeka\nNo. 1",
+            latitude=-6.175392,
+            longitude=106.827153,
+        )
+        image = File.objects.create(name="Background")
+        image.file.save("background.png", ContentFile(b"png" * 100))
+        Slider.objects.create(mosque=self.mosque, background_image=image, text="Ramadan \U0001F319")
+        Slider.objects.create(mosque=self.mosque, background_image=File.objects.create(name="Empty"))
+        Slider.objects.create(mosque=self.mosque, text="Tab\tand \x01 control \u2029")
+        TextMarquee.objects.create(mosque=self.mosque, text="Kajian ba'da maghrib")
+        today = now().date()
+        PrayerTime.objects.bulk_create([
+            PrayerTime(
+                mosque=self.mosque, date=today + timedelta(days=offset),
+                imsak="04:20", fajr="04:30", sunrise="05:45", dhuhr="11:55", asr="15:15",
+                sunset="17:55", maghrib="18:00", isha="19:10", midnight="23:50",
+            )
+            for offset in range(-3, 40)
+        ])
+
+    def assertSameOutput(self, days=None):
+        today = now().date()
+        expected = JSONRenderer().render(build_tv_content(self.mosque.pk, today, days))
+        self.assertEqual(render_json(tv_content_data(self.mosque.pk, today, days)), expected)
+
+    def test_encoder_matches_serializer(self):
+        self.assertSameOutput()
+        self.assertSameOutput(days=7)
+
+    def test_encoder_matches_serializer_without_configuration(self):
+        MasjidConfiguration.objects.filter(mosque=self.mosque).delete()
+        self.assertSameOutput()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TVContentPublishTests(TemporaryStorageMixin, MosqueTestMixin, APITestCase):
+    temporary_storages = (FILE_STORAGE,)
+    device_token = "sample-device-token"
+
+    def setUp(self):
+        super().setUp()
+        self.url = "/api/device/tv-content/snapshot/?uuid=sample-device-token"
+
+    def test_snapshot_is_published_once_per_version(self):
+        # Device requests never publish
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(PublishedSnapshot.objects.exists())
+
+        self.assertEqual(publish_snapshots([self.mosque.pk]), [self.mosque.pk])
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        published = PublishedSnapshot.objects.get(mosque=self.mosque)
+        self.assertEqual(response.data["version"], published.version)
+        self.assertEqual(response.data["url"], published.file.url)
+        with published.file.open("rb") as f:
+            self.assertEqual(
+                json.loads(f.read()),
+                json.loads(self.client.get("/api/device/tv-content/?uuid=sample-device-token").content),
+            )
+
+        self.assertEqual(publish_snapshots([self.mosque.pk]), [])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).data["url"], response.data["url"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Slider.objects.create(mosque=self.mosque, text="Ramadan")
+        # Unpublished changes leave devices on the published snapshot
+        self.assertEqual(self.client.get(self.url).data["url"], response.data["url"])
+        self.assertEqual(publish_snapshots([self.mosque.pk]), [self.mosque.pk])
+        republished = PublishedSnapshot.objects.get(mosque=self.mosque)
+        self.assertGreater(republished.version, published.version)
+        self.assertTrue(FILE_STORAGE.exists(republished.file.name))
+        self.assertEqual(self.client.get(self.url).data["url"], republished.file.url)
+
+        # The replaced object outlives its grace period only
+        self.assertEqual(republished.previous_file.name, published.file.name)
+        self.assertEqual(delete_replaced_snapshots(), 0)
+        self.assertTrue(FILE_STORAGE.exists(published.file.name))
+        output = io.StringIO()
+        PublishedSnapshot.objects.update(published_at=now() - timedelta(hours=2))
+        call_command("publish_tv_content", stdout=output)
+        self.assertIn("deleted 1 replaced snapshots", output.getvalue())
+        self.assertFalse(FILE_STORAGE.exists(published.file.name))
+        self.assertTrue(FILE_STORAGE.exists(republished.file.name))
+        self.assertEqual(PublishedSnapshot.objects.get(mosque=self.mosque).previous_file.name, "")
+
+    def test_upload_that_lost_the_race_is_deleted(self):
+        publish_snapshots([self.mosque.pk])
+        published = PublishedSnapshot.objects.get(mosque=self.mosque)
+        # A publisher that built an older version meanwhile
+        older = {"version": published.version - 1, "body": b"{}"}
+        with mock.patch("api.publish.get_tv_content", return_value=older):
+            pointer = publish_snapshot(self.mosque.pk, published.day)
+        self.assertEqual(pointer["version"], published.version)
+        self.assertEqual(pointer["url"], published.file.url)
+        self.assertEqual(
+            FILE_STORAGE.listdir("tv-content/%s" % self.mosque.pk)[1],
+            [published.file.name.rsplit("/", 1)[1]],
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TVContentBundleTests(TemporaryStorageMixin, MosqueTestMixin, APITestCase):
+    temporary_storages = (FILE_STORAGE, STORAGE_BUNDLE)
+    device_token = "sample-device-token"
+
+    def setUp(self):
+        super().setUp()
+        self.image = File.objects.create(name="Background")
+        self.image.file.save("background.png", ContentFile(b"png" * 1000))
+        Slider.objects.create(mosque=self.mosque, background_image=self.image, text="Welcome")
+        Slider.objects.create(mosque=self.mosque, text="No background")
+        self.url = "/api/device/tv-content/bundle/?uuid=sample-device-token"
+
+    def test_bundle_holds_content_and_media(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        streamed = b"".join(response.streaming_content)
+
+        archive = zipfile.ZipFile(io.BytesIO(streamed))
+        self.assertIsNone(archive.testzip())
+        content = self.client.get("/api/device/tv-content/?uuid=sample-device-token")
+        self.assertEqual(archive.read("tv-content.json"), content.content)
+        self.assertEqual(
+            archive.read("files/%s/background.png" % self.image.pk), b"png" * 1000
+        )
+        self.assertEqual(len(archive.namelist()), 2)
+
+        # Served from the stored bundle afterwards, byte for byte
+        cached = self.client.get(self.url)
+        self.assertEqual(b"".join(cached.streaming_content), streamed)
+        self.assertEqual(cached["ETag"], response["ETag"])
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+
+    def test_bundle_is_rebuilt_when_content_changes(self):
+        first = self.client.get(self.url)
+        b"".join(first.streaming_content)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.image.file.save("other.png", ContentFile(b"other"))
+
+        second = self.client.get(self.url)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(second.streaming_content)))
+        self.assertEqual(archive.read("files/%s/other.png" % self.image.pk), b"other")
+        self.assertEqual(len(STORAGE_BUNDLE.listdir(str(self.mosque.pk))[1]), 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PrayerTimeEngineTests(SimpleTestCase):
+    def setUp(self):
+        caches["prayer_schedule"].clear()
+
+    def test_engine_matches_praytimes(self):
+        start = date(2024, 1, 1)
+        dates = [start + timedelta(days=offset) for offset in range(366)]
+        for lat, lon, timezone in (
+            (-6.175392, 106.827153, 7),
+            (5.548290, 95.323753, 7),
+            (21.422487, 39.826206, 3),
+            (-33.924869, 18.424055, 2),
+            (64.146582, -21.942635, 0),
+        ):
+            schedule = ShalatSchedule(lat, lon)
+            expected = [
+                {'date': day.strftime('%Y-%m-%d'), **schedule.pray_times.getTimes(day, (lat, lon), timezone)}
+                for day in dates
+            ]
+            self.assertEqual(schedule.compute_schedule(dates, timezone), expected)
+
+    def test_grid_matches_engine_for_nearby_mosques(self):
+        params = ShalatSchedule(0, 0).pray_times.getSettings()
+        dates = [date(2024, 12, 1) + timedelta(days=offset) for offset in range(400)]
+        rng = numpy.random.default_rng(7)
+        for lat, lon, timezone in ((-6.2, 106.8, 7), (3.59, 98.67, 7), (59.9, 10.7, 1)):
+            lats = lat + rng.uniform(-0.01, 0.01, 40)
+            lons = lon + rng.uniform(-0.01, 0.01, 40)
+            expected = prayer_engine.compute_times(dates, lats[:, None], lons[:, None], params, timezone)
+            for _ in range(2):
+                # Computed, then served from the cache
+                times = schedule_grid.grid_times(dates, lats, lons, params, timezone)
+                for name in prayer_engine.TIME_NAMES:
+                    numpy.testing.assert_array_equal(times[name], expected[name])
+
+    def test_grid_asr_where_the_declination_crosses_the_cell(self):
+        # The sun's declination is the mosque's latitude that day, asr peaks
+        # inside the cell rather than at a corner
+        lat, lon, timezone, day = -3.8990700696782157, 106.103997, 7, date(2024, 3, 10)
+        schedule = ShalatSchedule(lat, lon)
+        params = schedule.pray_times.getSettings()
+        times = schedule_grid.grid_times([day], [lat], [lon], params, timezone)
+        self.assertEqual(prayer_engine.format_minutes(times["asr"][0, 0]), "15:08")
+        self.assertEqual(schedule.pray_times.getTimes(day, (lat, lon), timezone)["asr"], "15:08")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class GeneratePrayerTimesTests(TestCase):
+    def test_generates_missing_days_of_mosques(self):
+        jakarta = create_mosque()
+        aceh = Mosque.objects.create(name="Baiturrahman", address="Banda Aceh", latitude=5.553593, longitude=95.317223)
+        MasjidConfiguration.objects.filter(mosque=aceh).update(prayer_duration_days=5)
+        ignored = Mosque.objects.create(name="Other", address="Bandung", latitude=-6.9, longitude=107.6)
+        today = now().date()
+        kept = PrayerTime.objects.create(
+            mosque=jakarta, date=today, imsak="04:00", fajr="04:10", sunrise="05:30", dhuhr="11:50",
+            asr="15:10", sunset="17:50", maghrib="17:55", isha="19:05", midnight="23:50",
+        )
+
+        call_command(
+            "generate_prayer_times", mosque_ids=[jakarta.pk, aceh.pk], workers=1, chunk_size=1,
+            stdout=io.StringIO(),
+        )
+
+        self.assertEqual(PrayerTime.objects.filter(mosque=jakarta).count(), 30)
+        self.assertEqual(PrayerTime.objects.filter(mosque=aceh).count(), 5)
+        self.assertFalse(PrayerTime.objects.filter(mosque=ignored).exists())
+        kept.refresh_from_db()
+        self.assertEqual(kept.fajr.isoformat(), "04:10:00")
+
+        dates = [today + timedelta(days=offset) for offset in range(5)]
+        expected = ShalatSchedule(aceh.latitude, aceh.longitude).compute_schedule(dates, 7)
+        generated = PrayerTime.objects.filter(mosque=aceh).order_by("date")
+        for day, row in zip(expected, generated):
+            self.assertEqual(row.date.isoformat(), day["date"])
+            self.assertEqual(row.maghrib.strftime("%H:%M"), day["maghrib"])
+            self.assertEqual(row.midnight.strftime("%H:%M"), day["midnight"])
+
+    def test_only_missing_days_are_generated(self):
+        mosque = create_mosque()
+        MasjidConfiguration.objects.filter(mosque=mosque).update(prayer_duration_days=10)
+        call_command("generate_prayer_times", workers=1, stdout=io.StringIO())
+        self.assertEqual(PrayerTime.objects.filter(mosque=mosque).count(), 10)
+
+        output = io.StringIO()
+        call_command("generate_prayer_times", workers=1, stdout=output)
+        self.assertIn("All 1 mosques are up to date.", output.getvalue())
+
+        # A longer window only adds its tail
+        last = PrayerTime.objects.filter(mosque=mosque).latest("date")
+        MasjidConfiguration.objects.filter(mosque=mosque).update(prayer_duration_days=14)
+        PrayerTime.objects.filter(pk=last.pk).update(fajr="03:00")
+        call_command("generate_prayer_times", workers=1, stdout=io.StringIO())
+        self.assertEqual(PrayerTime.objects.filter(mosque=mosque).count(), 14)
+        self.assertEqual(PrayerTime.objects.get(pk=last.pk).fajr.isoformat(), "03:00:00")
+
+        # The whole window is recomputed and upserted on demand
+        call_command("generate_prayer_times", workers=1, full=True, stdout=io.StringIO())
+        self.assertEqual(PrayerTime.objects.filter(mosque=mosque).count(), 14)
+        self.assertNotEqual(PrayerTime.objects.get(pk=last.pk).fajr.isoformat(), "03:00:00")
+
+    def test_run_is_idempotent(self):
+        mosque = create_mosque()
+        with mock.patch("builtins.print"):
+            prayertimes.run(mosque.pk)
+            prayertimes.run(mosque.pk)
+        self.assertEqual(PrayerTime.objects.filter(mosque=mosque).count(), 31)
+
+    def test_schedule_is_written_in_batches(self):
+        mosque = create_mosque()
+        schedule = ShalatSchedule(mosque.latitude, mosque.longitude)
+        start = date(2024, 1, 1)
+        end = start + timedelta(days=799)
+
+        days = schedule.iter_schedule(start, end, 7, block_days=300)
+        with mock.patch(
+            "libs.prayertimes.upsert_prayer_times", wraps=prayertimes.upsert_prayer_times
+        ) as upsert:
+            self.assertEqual(prayertimes.write_prayer_times(mosque.pk, days, batch_size=100), 800)
+        self.assertEqual(upsert.call_count, 8)
+        self.assertEqual(PrayerTime.objects.filter(mosque=mosque).count(), 800)
+
+        dates = [start + timedelta(days=offset) for offset in range(800)]
+        expected = schedule.compute_schedule(dates, 7)
+        stored = PrayerTime.objects.filter(mosque=mosque).order_by("date")
+        for day, row in zip(expected, stored):
+            self.assertEqual(row.date.isoformat(), day["date"])
+            for name in prayer_engine.TIME_NAMES:
+                self.assertEqual(getattr(row, name).strftime("%H:%M"), day[name])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ComputedPrayerScheduleTests(MosqueTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        schedules.clear()
+        self.addCleanup(schedules.clear)
+        MasjidConfiguration.objects.filter(mosque=self.mosque).update(prayer_duration_days=7)
+
+    def test_computed_schedule_matches_stored_rows(self):
+        call_command("generate_prayer_times", workers=1, stdout=io.StringIO())
+        today = now().date()
+        stored = build_tv_content(self.mosque.pk, today)
+
+        PrayerTime.objects.all().delete()
+        with mock.patch("api.computed_schedule.PRAYER_TIME_BACKEND", "computed"):
+            computed = build_tv_content(self.mosque.pk, today)
+            self.assertEqual(render_json(tv_content_data(self.mosque.pk, today)), JSONRenderer().render(computed))
+            self.assertEqual(schedules.misses, 7)
+            self.assertEqual(schedules.hits, 7)
+        self.assertEqual(len(computed["prayer_schedule"]), 7)
+        self.assertEqual(computed["prayer_schedule"], stored["prayer_schedule"])
+
+    def test_lru_is_bounded(self):
+        lru = ScheduleLRU(maxsize=10)
+        today = now().date()
+        dates = [today + timedelta(days=offset) for offset in range(8)]
+        lru.get_days(-6.2, 106.8, dates)
+        lru.get_days(-6.9, 107.6, dates)
+        self.assertEqual(len(lru.days), 10)
+        lru.get_days(-6.9, 107.6, dates)
+        self.assertEqual(lru.hits, 8)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PackedPrayerScheduleTests(MosqueTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+
+    def test_pack_and_slice_days(self):
+        days = [(offset, 60, 300, 700, 900, 1080, 1090, 1150, 1439) for offset in range(10)]
+        days[4] = (-1,) + days[4][1:]
+        data = pack_days(days)
+        self.assertEqual(len(data), 10 * 9 * 2)
+        self.assertEqual(unpack_days(data, 2, 3), [days[2], days[3], None])
+        # Days past the end of the data aren't stored
+        self.assertEqual(unpack_days(data, 8, 4), [days[8], days[9], None, None])
+
+    def test_packed_schedule_matches_stored_rows(self):
+        # Crosses into the next year
+        days = (date(now().year, 12, 31) - now().date()).days + 10
+        call_command("generate_prayer_times", days=days, workers=1, stdout=io.StringIO())
+        stored = list(PrayerTime.objects.filter(mosque=self.mosque).order_by("date"))
+        self.assertEqual(len(stored), days)
+        stored_content = build_tv_content(self.mosque.pk, now().date(), 7)
+
+        with mock.patch("api.packed_schedule.PRAYER_TIME_BACKEND", "packed"):
+            call_command("generate_prayer_times", days=days, workers=1, stdout=io.StringIO())
+            self.assertEqual(
+                list(PrayerYear.objects.filter(mosque=self.mosque).values_list("year", flat=True)),
+                [now().year, now().year + 1],
+            )
+            packed = packed_prayer_schedule(self.mosque.pk, now().date(), days)
+            self.assertEqual(
+                [[getattr(row, name) for name in ("date",) + prayer_engine.TIME_NAMES] for row in packed],
+                [[getattr(row, name) for name in ("date",) + prayer_engine.TIME_NAMES] for row in stored],
+            )
+
+            PrayerTime.objects.all().delete()
+            packed_content = build_tv_content(self.mosque.pk, now().date(), 7)
+            self.assertEqual(packed_content["prayer_schedule"], stored_content["prayer_schedule"])
+
+            output = io.StringIO()
+            call_command("generate_prayer_times", days=days, workers=1, stdout=output)
+            self.assertIn("All 1 mosques are up to date.", output.getvalue())
+
+        prayer_year = PrayerYear.objects.get(mosque=self.mosque, year=now().year)
+        table = PrayerYearAdmin(PrayerYear, admin.site).schedule(prayer_year)
+        self.assertIn("<td>%s</td>" % stored[0].maghrib.strftime("%H:%M"), table)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PrunePrayerTimesTests(TemporaryStorageMixin, MosqueTestMixin, TestCase):
+    temporary_storages = (ARCHIVE_STORAGE,)
+
+    def setUp(self):
+        super().setUp()
+        today = now().date()
+        for offset in range(-5, 3):
+            PrayerTime.objects.create(
+                mosque=self.mosque, date=today + timedelta(days=offset), imsak="04:00", fajr="04:10",
+                sunrise="05:30", dhuhr="11:50", asr="15:10", sunset="17:50", maghrib="17:55",
+                isha="19:05", midnight="23:50",
+            )
+
+    def test_past_rows_are_archived_and_deleted(self):
+        past_ids = list(
+            PrayerTime.objects.filter(date__lt=now().date()).order_by("id").values_list("id", flat=True)
+        )
+        self.assertTrue(LogEntry.objects.get_for_objects(PrayerTime.objects.filter(id__in=past_ids)).exists())
+        output = io.StringIO()
+        call_command("prune_prayer_times", archive=True, batch_size=2, stdout=output)
+
+        self.assertIn("Deleted 5 prayer times", output.getvalue())
+        self.assertIn("rows/s", output.getvalue())
+        self.assertFalse(PrayerTime.objects.filter(date__lt=now().date()).exists())
+        self.assertEqual(PrayerTime.objects.count(), 3)
+        self.assertFalse(LogEntry.objects.filter(object_id__in=past_ids, content_type__model="prayertime").exists())
+
+        def read_archive(prefix):
+            name, = [name for name in ARCHIVE_STORAGE.listdir("prayer-times")[1] if name.startswith(prefix)]
+            with ARCHIVE_STORAGE.open("prayer-times/" + name, "rb") as file:
+                return list(csv.DictReader(io.TextIOWrapper(gzip.GzipFile(fileobj=file), encoding="utf-8")))
+
+        rows = read_archive("before-")
+        self.assertEqual([int(row["id"]) for row in rows], past_ids)
+        self.assertEqual(rows[0]["fajr"], "04:10:00")
+        entries = read_archive("auditlog-before-")
+        self.assertEqual(sorted(int(entry["object_id"]) for entry in entries), past_ids)
+        self.assertEqual(json.loads(entries[0]["changes"])["fajr"], ["None", "04:10"])
+
+    def test_keep_days(self):
+        call_command("prune_prayer_times", keep_days=2, stdout=io.StringIO())
+        self.assertEqual(PrayerTime.objects.count(), 5)
+        self.assertEqual(
+            PrayerTime.objects.order_by("date").first().date, now().date() - timedelta(days=2)
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PrayerStateTests(MosqueTestMixin, APITestCase):
+    device_token = "state-token"
+
+    def setUp(self):
+        super().setUp()
+        # Thursday to Saturday
+        for day in (date(2025, 1, 2), date(2025, 1, 3), date(2025, 1, 4)):
+            PrayerTime.objects.create(
+                mosque=self.mosque, date=day, imsak="04:00", fajr="04:10", sunrise="05:30", dhuhr="12:00",
+                asr="15:20", sunset="18:10", maghrib="18:12", isha="19:25", midnight="23:50",
+            )
+        self.url = "/api/device/tv-content/state/?uuid=state-token"
+
+    def get_state(self, local_time):
+        with mock.patch("api.prayer_state.now", return_value=datetime.fromisoformat(local_time + "+07:00")):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_phases_of_the_day(self):
+        state = self.get_state("2025-01-02T12:05:00")
+        self.assertEqual((state["phase"], state["prayer"]), ("adzan", "dhuhr"))
+        self.assertEqual(state["seconds_to_transition"], 300)
+        self.assertEqual(state["next_prayer"], "asr")
+        self.assertEqual(state["next_prayer_at"], "2025-01-02T15:20:00+07:00")
+
+        state = self.get_state("2025-01-02T12:15:00")
+        self.assertEqual((state["phase"], state["prayer"]), ("iqomah", "dhuhr"))
+        self.assertEqual(state["transition_at"], "2025-01-02T12:20:00+07:00")
+
+        state = self.get_state("2025-01-02T12:20:00")
+        self.assertEqual((state["phase"], state["prayer"]), ("idle", "dhuhr"))
+        self.assertEqual(state["transition_at"], "2025-01-02T15:20:00+07:00")
+        self.assertEqual(state["seconds_to_next_prayer"], 3 * 3600)
+
+        # After isha the next prayer is tomorrow's fajr, before fajr the
+        # current one is yesterday's isha
+        state = self.get_state("2025-01-02T23:00:00")
+        self.assertEqual((state["phase"], state["prayer"]), ("idle", "isha"))
+        self.assertEqual(state["next_prayer_at"], "2025-01-03T04:10:00+07:00")
+        state = self.get_state("2025-01-03T02:00:00")
+        self.assertEqual((state["phase"], state["prayer"]), ("idle", "isha"))
+        self.assertEqual(state["seconds_to_next_prayer"], 2 * 3600 + 600)
+
+    def test_friday_khutbah_and_configuration_changes(self):
+        state = self.get_state("2025-01-03T12:30:00")
+        self.assertEqual((state["phase"], state["prayer"]), ("khutbah", "dhuhr"))
+        self.assertEqual(state["transition_at"], "2025-01-03T12:55:00+07:00")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            configuration = MasjidConfiguration.objects.get(mosque=self.mosque)
+            configuration.khutbah_popup_duration = 1200
+            configuration.save()
+        state = self.get_state("2025-01-03T12:30:00")
+        self.assertEqual((state["phase"], state["prayer"]), ("idle", "dhuhr"))
+
+    def test_mosque_without_configuration(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            MasjidConfiguration.objects.filter(mosque=self.mosque).delete()
+        state = self.get_state("2025-01-03T12:30:00")
+        self.assertEqual((state["phase"], state["prayer"]), ("khutbah", "dhuhr"))
+        self.assertEqual(state["transition_at"], "2025-01-03T12:55:00+07:00")
+
+    def test_unknown_device(self):
+        response = self.client.get("/api/device/tv-content/state/?uuid=unknown")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TVContentStreamTests(MosqueTestMixin, TestCase):
+    device_token = "push-token"
+
+    def setUp(self):
+        super().setUp()
+        self.url = "/api/device/tv-content/stream/?uuid=push-token"
+        # The watcher's task belongs to the event loop of a single test
+        self.watcher = ContentVersionWatcher(interval=0.01)
+        patcher = mock.patch("api.views.push.watcher", self.watcher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_content_event_on_version_bump(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = response.streaming_content
+        try:
+            first = await anext(events)
+            self.assertTrue(first.startswith(b"id: "))
+            self.assertIn(b"event: content\n", first)
+            self.assertIn(b"Istiqlal", first)
+
+            bump_content_version(self.mosque.pk)
+            second = await asyncio.wait_for(anext(events), 5)
+            self.assertIn(b"event: content\n", second)
+            self.assertNotEqual(second.split(b"\n")[0], first.split(b"\n")[0])
+        finally:
+            await events.aclose()
+
+    async def test_heartbeat_while_unchanged(self):
+        buffer = HeartbeatBuffer(interval=None, enabled=True)
+        with mock.patch("api.views.push.HEARTBEAT_INTERVAL", 0.05), \
+                mock.patch("api.views.push.heartbeats", buffer):
+            events = content_events(self.device.pk, self.mosque.pk)
+            try:
+                self.assertIn(b"event: content\n", await anext(events))
+                self.assertEqual(await asyncio.wait_for(anext(events), 5), b": heartbeat\n\n")
+            finally:
+                await events.aclose()
+        self.assertIn(self.device.pk, buffer.pending)
+
+    async def test_disconnect_unsubscribes(self):
+        events = content_events(self.device.pk, self.mosque.pk)
+        await anext(events)
+        # The ASGI handler cancels the response when the client disconnects
+        waiting = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.watcher.subscribers[self.mosque.pk], 1)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertFalse(self.watcher.subscribers)
+        self.assertFalse(self.watcher.events)
+
+    def test_refused_outside_asgi(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 421)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TVContentWaitTests(MosqueTestMixin, TestCase):
+    device_token = "wait-token"
+
+    def setUp(self):
+        super().setUp()
+        self.url = "/api/device/tv-content/wait/?uuid=wait-token"
+        patcher = mock.patch("api.views.push.watcher", ContentVersionWatcher(interval=0.01))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_stale_version_returns_at_once(self):
+        response = await self.async_client.get(self.url + "&version=1&wait=30")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["mosque"]["name"], "Istiqlal")
+        self.assertNotEqual(response["X-Content-Version"], "1")
+
+    async def test_unchanged_version_times_out(self):
+        version = (await self.async_client.get(self.url))["X-Content-Version"]
+        response = await self.async_client.get(self.url + "&version=%s&wait=0.1" % version)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["X-Content-Version"], version)
+
+    async def test_change_while_waiting(self):
+        version = (await self.async_client.get(self.url))["X-Content-Version"]
+        waiting = asyncio.ensure_future(self.async_client.get(self.url + "&version=%s&wait=5" % version))
+        await asyncio.sleep(0.05)
+        bump_content_version(self.mosque.pk)
+        response = await asyncio.wait_for(waiting, 5)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["X-Content-Version"], version)
+
+    def test_refused_outside_asgi(self):
+        self.assertEqual(self.client.get(self.url).status_code, 421)
@@ -0,0 +1,149 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.timezone import now
+from rest_framework.exceptions import Throttled
+from ..heartbeat import heartbeats
+from ..device_cache import resolve_device
+from ..push import watcher, HEARTBEAT_INTERVAL
+from ..snapshot import (
+    get_tv_content, get_content_version, content_etag, negotiate_encoding, MAX_PRAYER_DAYS
+)
+
+DEFAULT_WAIT = getattr(settings, "TV_LONG_POLL_DEFAULT_WAIT", 30)
+MAX_WAIT = getattr(settings, "TV_LONG_POLL_MAX_WAIT", 60)
+
+
+def asgi_only(view):
+    """
+    Refuse the requests of a push view that didn't come through the ASGI
+    server (uvicorn, port 8002). Under uWSGI a held connection would take a
+    whole sync worker, so these paths have to be routed to the ASGI server.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse({"detail": "Only served by the ASGI server."}, status=421)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def event_id(version, day):
+    return "%s.%s" % (version, day.strftime("%Y%m%d"))
+
+
+async def content_events(device_id, mosque_id, last_event_id=None):
+    """
+    Server-sent events of the TV content of a mosque: a ``content`` event
+    whenever it changes (or a new day starts) and a comment as heartbeat.
+    """
+    sent_id = last_event_id
+    while True:
+        day = now().date()
+        snapshot = await sync_to_async(get_tv_content)(mosque_id, day)
+        version = snapshot["version"]
+        if event_id(version, day) != sent_id:
+            sent_id = event_id(version, day)
+            yield b"id: %s\nevent: content\ndata: %s\n\n" % (sent_id.encode(), snapshot["body"])
+
+        while await watcher.wait_for_change(mosque_id, version, HEARTBEAT_INTERVAL) is None:
+            if now().date() != day:
+                break
+            heartbeats.record(device_id)
+            yield b": heartbeat\n\n"
+
+
+@asgi_only
+async def tv_content_stream(request):
+    """
+    Push the TV content to a device over server-sent events.
+
+    The device subscribes once with its ``uuid`` and receives the content
+    again only when the mosque's content or configuration changes. Served by
+    the ASGI server, where an idle subscription doesn't hold a worker.
+    """
+    uuid = request.GET.get("uuid")
+    if not uuid:
+        return JsonResponse({"error": "UUID is required."}, status=400)
+
+    try:
+        device = await sync_to_async(resolve_device)(uuid, request)
+    except Throttled as throttled:
+        return JsonResponse(
+            {"detail": throttled.detail}, status=429,
+            headers={"Retry-After": "%d" % throttled.wait} if throttled.wait else None,
+        )
+    if device is None:
+        return JsonResponse({"detail": "Device not found."}, status=404)
+    if not device.is_active:
+        return JsonResponse({"detail": "Device is inactive."}, status=403)
+    heartbeats.record(device.id)
+
+    response = StreamingHttpResponse(
+        content_events(device.id, device.mosque_id, request.headers.get("Last-Event-ID")),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # Keep reverse proxies from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@asgi_only
+async def tv_content_wait(request):
+    """
+    Long-poll variant of the device tv-content endpoint.
+
+    With ``version`` set to the X-Content-Version the device already has,
+    the request is held until the mosque's content moves past it, or
+    answered with 304 after ``wait`` seconds. Served by the ASGI server,
+    where a held request doesn't hold a worker.
+    """
+    uuid = request.GET.get("uuid")
+    if not uuid:
+        return JsonResponse({"error": "UUID is required."}, status=400)
+
+    try:
+        version = int(request.GET["version"]) if "version" in request.GET else None
+        wait = min(float(request.GET.get("wait", DEFAULT_WAIT)), MAX_WAIT)
+        days = min(int(request.GET["days"]), MAX_PRAYER_DAYS) if "days" in request.GET else None
+    except ValueError:
+        return JsonResponse({"error": "version, wait and days must be numbers."}, status=400)
+    if days is not None and days < 1:
+        return JsonResponse({"error": "days must be a positive number."}, status=400)
+
+    try:
+        device = await sync_to_async(resolve_device)(uuid, request)
+    except Throttled as throttled:
+        return JsonResponse(
+            {"detail": throttled.detail}, status=429,
+            headers={"Retry-After": "%d" % throttled.wait} if throttled.wait else None,
+        )
+    if device is None:
+        return JsonResponse({"detail": "Device not found."}, status=404)
+    if not device.is_active:
+        return JsonResponse({"detail": "Device is inactive."}, status=403)
+    heartbeats.record(device.id)
+    mosque_id = device.mosque_id
+
+    current = await sync_to_async(get_content_version)(mosque_id)
+    if current == version and wait > 0:
+        current = await watcher.wait_for_change(mosque_id, version, wait) or version
+    today = now().date()
+    if current == version:
+        response = HttpResponseNotModified()
+    else:
+        snapshot = await sync_to_async(get_tv_content)(mosque_id, today, days)
+        current = snapshot["version"]
+        encoding, body = negotiate_encoding(snapshot, request.headers.get("Accept-Encoding"))
+        response = HttpResponse(body, content_type="application/json")
+        if encoding:
+            response["Content-Encoding"] = encoding
+        response["Vary"] = "Accept-Encoding"
+    response["ETag"] = content_etag(mosque_id, current, today, days)
+    response["X-Content-Version"] = str(current)
+    response["Cache-Control"] = "no-cache"
+    return response
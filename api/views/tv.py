@@ -1,19 +1,88 @@
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework.viewsets import ViewSet
+from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.permissions import AllowAny
+from rest_framework.settings import api_settings
+from django.http import HttpResponse, FileResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
 from django.utils.timezone import now
-from ..models import Device, PrayerTime, Slider, TextMarquee, MasjidConfiguration
 from ..serializers import TVContentSerializer
+from ..snapshot import (
+    get_tv_content, get_content_version, content_etag, negotiate_encoding, needs_full_sync,
+    MAX_PRAYER_DAYS
+)
+from ..delta import build_tv_content_delta, is_version
+from ..heartbeat import heartbeats
+from ..device_cache import resolve_device
+from ..encoders import compact_tv_content
+from ..renderers import MessagePackRenderer, msgpack
+from ..publish import get_published_snapshot
+from ..bundle import get_bundle, stream_bundle
+from ..prayer_state import get_prayer_state
+
+
+def etag_matches(request, etag):
+    """
+    Weak comparison of ``etag`` against the request's If-None-Match header.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    if "*" in etags:
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.removeprefix("W/") == opaque for tag in etags)
+
+
+def not_modified(etag, version):
+    return Response(status=304, headers={"ETag": etag, "X-Content-Version": str(version)})
+
+
+def parse_days(value):
+    """
+    Return the number of prayer days asked for, capped at MAX_PRAYER_DAYS,
+    or 0 when it isn't a number.
+    """
+    if value is None:
+        return None
+    try:
+        return min(int(value), MAX_PRAYER_DAYS)
+    except ValueError:
+        return 0
+
+
+def active_device(request, uuid):
+    """
+    Return the device with the unique identifier and record its heartbeat,
+    raising 404 or 403 when it is unknown or inactive, and 429 when the
+    client looked up too many unknown ones.
+    """
+    device = resolve_device(uuid, request)
+    if device is None:
+        raise NotFound("Device not found.")
+    if not device.is_active:
+        raise PermissionDenied("Device is inactive.")
+    heartbeats.record(device.id)
+    return device
 
 
 class TVContentViewSet(ViewSet):
     """
     Endpoint to fetch content for TV based on its unique identifier.
+
+    Served as JSON by default, or in a compact MessagePack format to devices
+    that accept ``application/msgpack``, where the prayer schedule is
+    columnar with dates as days since 1970-01-01 and times as minutes since
+    midnight.
     """
     permission_classes = [AllowAny]  # Allow unauthenticated access
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + (
+        [MessagePackRenderer] if msgpack is not None else []
+    )
 
     @swagger_auto_schema(
         manual_parameters=[
@@ -23,12 +92,46 @@ class TVContentViewSet(ViewSet):
                 description="The unique identifier of the TV device.",
                 type=openapi.TYPE_STRING,
                 required=True
+            ),
+            openapi.Parameter(
+                "days",
+                openapi.IN_QUERY,
+                description=(
+                    "Number of prayer days to return starting today, defaults to "
+                    "the mosque's prayer_duration_days (at most %s)." % MAX_PRAYER_DAYS
+                ),
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                "since",
+                openapi.IN_QUERY,
+                description=(
+                    "Content version the TV already has (X-Content-Version). "
+                    "Only the content changed since then is returned, with the "
+                    "ids of deleted sliders and marquees and dates of deleted "
+                    "prayer days under `deleted`. The full content, without "
+                    "`since`, is returned instead when a change committed too "
+                    "late to be told apart from that version."
+                ),
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                "If-None-Match",
+                openapi.IN_HEADER,
+                description="ETag of the content the TV already has.",
+                type=openapi.TYPE_STRING,
+                required=False
             )
         ],
         responses={
             200: TVContentSerializer,
-            400: openapi.Response(description="UUID is missing or invalid."),
-            404: openapi.Response(description="Device not found.")
+            304: openapi.Response(description="Content has not changed since the given ETag."),
+            400: openapi.Response(description="UUID is missing or invalid, days is not a number or since not a content version."),
+            403: openapi.Response(description="Device is inactive."),
+            404: openapi.Response(description="Device not found."),
+            429: openapi.Response(description="Too many unknown devices looked up.")
         }
     )
     def list(self, request, *args, **kwargs):
@@ -37,28 +140,228 @@ class TVContentViewSet(ViewSet):
         if not uuid:
             return Response({"error": "UUID is required."}, status=400)
 
+        days = parse_days(request.query_params.get('days'))
+        if days is not None and days < 1:
+            return Response({"error": "days must be a positive number."}, status=400)
+
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                since = None
+            if since is None or not is_version(since):
+                return Response({"error": "since must be a content version."}, status=400)
+
         # Find the device by its unique identifier
-        try:
-            device = Device.objects.select_related('mosque').get(device_token=uuid)
-        except Device.DoesNotExist:
-            raise NotFound("Device not found.")
+        device = active_device(request, uuid)
 
-        # Fetch related data
-        mosque = device.mosque
+        mosque_id = device.mosque_id
         today = now().date()
+        binary = request.accepted_renderer.format == MessagePackRenderer.format
+
+        # Answer conditional requests from the content version alone
+        version = get_content_version(mosque_id)
+        etag = content_etag(mosque_id, version, today, days, request.accepted_renderer.format)
+        if etag_matches(request, etag):
+            return not_modified(etag, version)
+
+        if since is not None and not needs_full_sync(mosque_id, since):
+            if since >= version:
+                return not_modified(etag, version)
+            delta = build_tv_content_delta(mosque_id, since, today, days)
+            if binary:
+                delta = compact_tv_content(delta)
+            return Response({"version": version, "since": since, **delta}, headers={
+                "X-Content-Version": str(version),
+                "Cache-Control": "no-cache",
+            })
+
+        # Serve the mosque's content from its cached snapshot, already
+        # rendered and compressed
+        snapshot = get_tv_content(mosque_id, today, days)
+        if binary:
+            response = HttpResponse(snapshot["msgpack"], content_type=MessagePackRenderer.media_type)
+        else:
+            encoding, body = negotiate_encoding(snapshot, request.headers.get("Accept-Encoding"))
+            response = HttpResponse(body, content_type="application/json")
+            if encoding:
+                response["Content-Encoding"] = encoding
+        response["Vary"] = "Accept, Accept-Encoding"
+        response["ETag"] = content_etag(
+            mosque_id, snapshot["version"], today, days, request.accepted_renderer.format
+        )
+        response["X-Content-Version"] = str(snapshot["version"])
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "uuid",
+                openapi.IN_QUERY,
+                description="The unique identifier of the TV device.",
+                type=openapi.TYPE_STRING,
+                required=True
+            )
+        ],
+        responses={
+            200: openapi.Response(
+                description="URL of the published static snapshot of the TV content.",
+                examples={
+                    "application/json": {
+                        "url": "https://cdn.example.com/file/tv-content/1/20250101-1735689600000000.json",
+                        "version": 1735689600000000,
+                        "day": "2025-01-01",
+                    }
+                },
+            ),
+            400: openapi.Response(description="UUID is missing."),
+            403: openapi.Response(description="Device is inactive."),
+            404: openapi.Response(description="Device not found, or no snapshot published yet."),
+            429: openapi.Response(description="Too many unknown devices looked up.")
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='snapshot')
+    def snapshot(self, request, *args, **kwargs):
+        """
+        Hand out the URL of the latest static snapshot of the device's TV
+        content, as published by the ``publish_tv_content`` command.
+        """
+        uuid = request.query_params.get('uuid')
+        if not uuid:
+            return Response({"error": "UUID is required."}, status=400)
 
-        prayer_schedule = PrayerTime.objects.filter(mosque=mosque, date__gte=today)
-        sliders = Slider.objects.filter(mosque=mosque)
-        text_marquee = TextMarquee.objects.filter(mosque=mosque)
-        configurations = MasjidConfiguration.objects.filter(mosque=mosque).first()
-
-        # Serialize the data
-        serializer = TVContentSerializer({
-            "mosque": mosque,
-            "prayer_schedule": prayer_schedule,
-            "sliders": sliders,
-            "text_marquee": text_marquee,
-            "configurations": configurations
+        device = active_device(request, uuid)
+        pointer = get_published_snapshot(device.mosque_id)
+        if pointer is None:
+            return Response({"detail": "No snapshot published yet."}, status=404)
+        return Response({**pointer, "day": pointer["day"].isoformat()}, headers={
+            "X-Content-Version": str(pointer["version"]),
+            "Cache-Control": "no-cache",
         })
 
-        return Response(serializer.data)
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "uuid",
+                openapi.IN_QUERY,
+                description="The unique identifier of the TV device.",
+                type=openapi.TYPE_STRING,
+                required=True
+            ),
+            openapi.Parameter(
+                "days",
+                openapi.IN_QUERY,
+                description=(
+                    "Number of prayer days in the bundle starting today, defaults to "
+                    "the mosque's prayer_duration_days (at most %s)." % MAX_PRAYER_DAYS
+                ),
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                "If-None-Match",
+                openapi.IN_HEADER,
+                description="ETag of the bundle the TV already has.",
+                type=openapi.TYPE_STRING,
+                required=False
+            )
+        ],
+        responses={
+            200: openapi.Response(
+                description=(
+                    "Zip of the TV content as `tv-content.json` and the slider "
+                    "backgrounds as `files/<id>/<name>`."
+                )
+            ),
+            304: openapi.Response(description="Content has not changed since the given ETag."),
+            400: openapi.Response(description="UUID is missing or days is not a number."),
+            403: openapi.Response(description="Device is inactive."),
+            404: openapi.Response(description="Device not found."),
+            429: openapi.Response(description="Too many unknown devices looked up.")
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='bundle')
+    def bundle(self, request, *args, **kwargs):
+        """
+        Stream the TV content and the media it refers to as a single zip, for
+        devices preloading their content to run offline.
+        """
+        uuid = request.query_params.get('uuid')
+        if not uuid:
+            return Response({"error": "UUID is required."}, status=400)
+
+        days = parse_days(request.query_params.get('days'))
+        if days is not None and days < 1:
+            return Response({"error": "days must be a positive number."}, status=400)
+
+        mosque_id = active_device(request, uuid).mosque_id
+        today = now().date()
+
+        version = get_content_version(mosque_id)
+        etag = content_etag(mosque_id, version, today, days, "zip")
+        if etag_matches(request, etag):
+            return not_modified(etag, version)
+
+        snapshot = get_tv_content(mosque_id, today, days)
+        bundle = get_bundle(mosque_id, snapshot, today, days)
+        if bundle is not None:
+            response = FileResponse(bundle, content_type="application/zip")
+        else:
+            response = StreamingHttpResponse(
+                stream_bundle(mosque_id, snapshot, today, days), content_type="application/zip"
+            )
+        response["Content-Disposition"] = 'attachment; filename="tv-content-%s.zip"' % snapshot["version"]
+        response["ETag"] = content_etag(mosque_id, snapshot["version"], today, days, "zip")
+        response["X-Content-Version"] = str(snapshot["version"])
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "uuid",
+                openapi.IN_QUERY,
+                description="The unique identifier of the TV device.",
+                type=openapi.TYPE_STRING,
+                required=True
+            )
+        ],
+        responses={
+            200: openapi.Response(
+                description=(
+                    "The current phase, `adzan`, `iqomah`, `khutbah` or `idle`, the "
+                    "prayer it belongs to, and when the phase and the next prayer start."
+                ),
+                examples={
+                    "application/json": {
+                        "server_time": "2025-01-03T12:05:00+07:00",
+                        "phase": "khutbah",
+                        "prayer": "dhuhr",
+                        "transition_at": "2025-01-03T12:47:00+07:00",
+                        "seconds_to_transition": 2520,
+                        "next_prayer": "asr",
+                        "next_prayer_at": "2025-01-03T15:21:00+07:00",
+                        "seconds_to_next_prayer": 11760,
+                    }
+                },
+            ),
+            400: openapi.Response(description="UUID is missing."),
+            403: openapi.Response(description="Device is inactive."),
+            404: openapi.Response(description="Device not found."),
+            429: openapi.Response(description="Too many unknown devices looked up.")
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='state')
+    def state(self, request, *args, **kwargs):
+        """
+        Tell a device which prayer phase to show and how long until it
+        changes, so it doesn't have to work it out from the schedule.
+        """
+        uuid = request.query_params.get('uuid')
+        if not uuid:
+            return Response({"error": "UUID is required."}, status=400)
+
+        mosque_id = active_device(request, uuid).mosque_id
+        return Response(get_prayer_state(mosque_id), headers={"Cache-Control": "no-cache"})
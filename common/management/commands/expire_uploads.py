@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Q
+from django.utils.timezone import now
+
+from common.models import ChunkedUpload
+from common.views.chunk_upload import part_name
+from common.views.direct_upload import file_storage, object_key, s3_client
+from libs.storage import STORAGE_CHUNK
+
+# Seconds an unfinished upload is kept without any chunk received
+UPLOAD_EXPIRY = getattr(settings, "UPLOAD_EXPIRY", 24 * 60 * 60)
+
+
+def expire_upload(upload):
+    """
+    Drop the received bytes of an unfinished upload: its part file and
+    folder, or the parts the bucket holds for a direct upload.
+    """
+    if upload.multipart_id:
+        storage = file_storage()
+        try:
+            s3_client(storage).abort_multipart_upload(
+                Bucket=storage.bucket_name, Key=object_key(storage, upload.folder),
+                UploadId=upload.multipart_id,
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "NoSuchUpload":
+                raise
+    else:
+        STORAGE_CHUNK.delete(part_name(upload))
+        STORAGE_CHUNK.delete(upload.folder)
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the unfinished chunked and direct uploads that received nothing for "
+        "a while, with their part files and the parts held by the bucket."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours", type=float, default=UPLOAD_EXPIRY / 3600,
+            help="Hours without activity before an upload expires (default: UPLOAD_EXPIRY)",
+        )
+
+    def handle(self, *args, **options):
+        if options["hours"] <= 0:
+            raise CommandError("--hours must be positive.")
+        cutoff = now() - timedelta(hours=options["hours"])
+        expired = (
+            ChunkedUpload.objects.filter(is_done=False, updated_at__lt=cutoff)
+            .annotate(last_part_at=Max("parts__created_at"))
+            .filter(Q(last_part_at__isnull=True) | Q(last_part_at__lt=cutoff))
+        )
+
+        count = 0
+        for upload in expired.iterator():
+            expire_upload(upload)
+            upload.delete()
+            count += 1
+        self.stdout.write(self.style.SUCCESS("Deleted %d expired uploads" % count))
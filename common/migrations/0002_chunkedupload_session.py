@@ -0,0 +1,35 @@
+# Generated by Django 5.1.4 on 2026-10-17 12:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_prayeryear'),
+        ('common', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='crc32',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='created_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chunked_uploads', to='api.user'),
+        ),
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='offset',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.4 on 2026-10-17 12:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_chunkedupload_session'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='chunkedupload',
+            name='crc32',
+        ),
+        migrations.RemoveField(
+            model_name='chunkedupload',
+            name='offset',
+        ),
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='chunk_size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ChunkedUploadPart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('size', models.PositiveIntegerField()),
+                ('checksum', models.CharField(max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='common.chunkedupload')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('upload', 'number'), name='unique_chunked_upload_part')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-17 12:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0003_chunkedupload_parts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='multipart_id',
+            field=models.CharField(blank=True, max_length=1024),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-17 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0004_chunkedupload_multipart_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkeduploadpart',
+            name='crc32',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
@@ -30,12 +30,44 @@ class File(models.Model):
 
 
 class ChunkedUpload(models.Model):
+    created_by = models.ForeignKey(
+        "api.User", on_delete=models.CASCADE, blank=True, null=True, related_name="chunked_uploads"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     filename = models.CharField(max_length=128)
     folder = models.CharField(max_length=256)
     file = models.FileField(storage=CHUNK_UPLOAD_PRIVATE, blank=True, null=True)
     is_done = models.BooleanField(default=False)
+    size = models.PositiveBigIntegerField(default=0)  # Size of the whole file
+    chunk_size = models.PositiveIntegerField(default=0)  # Size of every chunk but the last
+    multipart_id = models.CharField(max_length=1024, blank=True)  # S3 UploadId of a direct upload
 
     def __str__(self):
         return self.filename
 
+    @property
+    def chunk_count(self):
+        return -(-self.size // self.chunk_size) if self.chunk_size else 0
+
+    def chunk_range(self, number):
+        start = number * self.chunk_size
+        return start, min(self.chunk_size, self.size - start)
+
+
+class ChunkedUploadPart(models.Model):
+    upload = models.ForeignKey(ChunkedUpload, on_delete=models.CASCADE, related_name="parts")
+    number = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=32)  # MD5 of the chunk
+    crc32 = models.BigIntegerField(null=True)  # Combined into the file's CRC-32 on finish
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["upload", "number"], name="unique_chunked_upload_part"),
+        ]
+
+    def __str__(self):
+        return "%s part %s" % (self.upload, self.number)
+
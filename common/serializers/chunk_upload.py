@@ -2,8 +2,8 @@ from rest_framework import serializers
 
 
 class ChunkUploadSerializer(serializers.Serializer):
-    file_name = serializers.CharField()
-    chunk = serializers.CharField(required=False)
-    chunk_no = serializers.IntegerField(required=False)
-    checksum = serializers.CharField(required=False)
-    chunk_count = serializers.IntegerField(required=False)
+    file_name = serializers.CharField(required=False)
+    upload_id = serializers.IntegerField(required=False)
+    checksum = serializers.RegexField(r"^[0-9a-fA-F]{8}$", required=False)
+    size = serializers.IntegerField(required=False, min_value=0)
+    chunk_size = serializers.IntegerField(required=False, min_value=1)
@@ -0,0 +1,20 @@
+import tempfile
+from unittest import mock
+
+
+class TemporaryStorageMixin:
+    """
+    Points each storage of ``temporary_storages`` at a temporary directory of
+    its own for every test.
+    """
+    temporary_storages = ()
+
+    def setUp(self):
+        super().setUp()
+        for storage in self.temporary_storages:
+            media = tempfile.TemporaryDirectory()
+            self.addCleanup(media.cleanup)
+            for attribute in ("base_location", "location"):
+                patcher = mock.patch.object(storage, attribute, media.name)
+                patcher.start()
+                self.addCleanup(patcher.stop)
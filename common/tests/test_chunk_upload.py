@@ -0,0 +1,167 @@
+import hashlib
+import io
+import zlib
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.utils.timezone import now
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from api.models import User
+from common.models import File, ChunkedUpload, ChunkedUploadPart
+from common.testing import TemporaryStorageMixin
+from libs.storage import FILE_STORAGE, STORAGE_CHUNK
+
+
+class ChunkUploadTests(TemporaryStorageMixin, APITestCase):
+    temporary_storages = (FILE_STORAGE, STORAGE_CHUNK)
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="admin", is_mosque_admin=True)
+        self.client.force_authenticate(self.user)
+        self.url = "/api/common/chunk-upload/"
+        self.data = bytes(range(256)) * 1000
+        self.chunk_size = 100000
+
+    def start_upload(self):
+        response = self.client.post(
+            self.url + "?is_init=1",
+            {"file_name": "../video.mp4", "size": len(self.data), "chunk_size": self.chunk_size},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["missing"], [[0, 2]])
+        return response.json()["upload_id"]
+
+    def send_chunk(self, upload_id, number, data=None):
+        if data is None:
+            data = self.data[number * self.chunk_size:(number + 1) * self.chunk_size]
+        return self.client.post(
+            "%s?upload_id=%s&chunk_no=%s&checksum=%s" % (
+                self.url, upload_id, number, hashlib.md5(data).hexdigest()
+            ),
+            data, content_type="application/octet-stream",
+        )
+
+    def finish_upload(self, upload_id, data):
+        return self.client.post(
+            self.url + "?is_checksum=1",
+            {"upload_id": upload_id, "checksum": "%08x" % zlib.crc32(data)},
+            format="json",
+        )
+
+    def test_chunks_in_any_order_are_moved_into_place(self):
+        upload_id = self.start_upload()
+        for number in (2, 0, 1):
+            self.assertEqual(self.send_chunk(upload_id, number).status_code, status.HTTP_200_OK)
+
+        response = self.finish_upload(upload_id, self.data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        file = File.objects.get(pk=response.json()["data"]["file_id"])
+        self.assertEqual(file.name, "video.mp4")
+        with file.file.open("rb") as stored:
+            self.assertEqual(stored.read(), self.data)
+        upload = ChunkedUpload.objects.get(pk=upload_id)
+        self.assertTrue(upload.is_done)
+        self.assertFalse(upload.parts.exists())
+        self.assertEqual(STORAGE_CHUNK.listdir(upload.folder)[1], [])
+
+    def test_resume_from_the_received_chunks(self):
+        upload_id = self.start_upload()
+        self.send_chunk(upload_id, 1)
+        # A corrupted or cut chunk isn't recorded
+        corrupted = self.client.post(
+            "%s?upload_id=%s&chunk_no=0&checksum=%s" % (self.url, upload_id, "0" * 32),
+            self.data[:self.chunk_size], content_type="application/octet-stream",
+        )
+        self.assertEqual(corrupted.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.send_chunk(upload_id, 2, self.data[-10:]).status_code, 400)
+
+        status_response = self.client.get("%s%s/" % (self.url, upload_id))
+        self.assertEqual(status_response.json()["received"], [[1, 1]])
+        self.assertEqual(status_response.json()["missing"], [[0, 0], [2, 2]])
+        self.assertEqual(self.finish_upload(upload_id, self.data).status_code, 400)
+
+        for first, last in status_response.json()["missing"]:
+            for number in range(first, last + 1):
+                self.send_chunk(upload_id, number)
+        self.assertEqual(self.finish_upload(upload_id, self.data[:-1] + b"x").status_code, 400)
+        self.assertEqual(self.finish_upload(upload_id, self.data).status_code, status.HTTP_200_OK)
+
+    def test_bad_resend_keeps_the_recorded_chunk(self):
+        upload_id = self.start_upload()
+        for number in range(3):
+            self.send_chunk(upload_id, number)
+        resend = self.client.post(
+            "%s?upload_id=%s&chunk_no=0&checksum=%s" % (
+                self.url, upload_id, hashlib.md5(self.data[:self.chunk_size]).hexdigest()
+            ),
+            b"x" * self.chunk_size, content_type="application/octet-stream",
+        )
+        self.assertEqual(resend.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get("%s%s/" % (self.url, upload_id)).json()["received"], [[0, 2]])
+        self.assertEqual(self.finish_upload(upload_id, self.data).status_code, status.HTTP_200_OK)
+
+    def test_file_checksum_is_combined_from_the_chunks(self):
+        upload_id = self.start_upload()
+        for number in range(3):
+            self.send_chunk(upload_id, number)
+        parts = ChunkedUploadPart.objects.filter(upload_id=upload_id).order_by("number")
+        self.assertEqual(
+            [part.crc32 for part in parts],
+            [
+                zlib.crc32(self.data[start:start + self.chunk_size])
+                for start in range(0, len(self.data), self.chunk_size)
+            ],
+        )
+        # A chunk recorded without its CRC-32 is sent again
+        parts.filter(number=1).update(crc32=None)
+        self.assertEqual(self.client.get("%s%s/" % (self.url, upload_id)).json()["missing"], [[1, 1]])
+        self.send_chunk(upload_id, 1)
+        self.assertEqual(self.finish_upload(upload_id, self.data).status_code, status.HTTP_200_OK)
+
+    def test_finish_needs_the_file_checksum(self):
+        upload_id = self.start_upload()
+        for number in range(3):
+            self.send_chunk(upload_id, number)
+        response = self.client.post(self.url + "?is_checksum=1", {"upload_id": upload_id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ChunkedUpload.objects.get(pk=upload_id).is_done)
+
+    def test_upload_limits(self):
+        for data, message in (
+            ({"size": 3 * 1024 * 1024 * 1024}, "allowed_size"),
+            ({"size": len(self.data), "chunk_size": 1}, "chunk_size"),
+            ({"size": len(self.data), "chunk_size": 1024 * 1024 * 1024}, "chunk_size"),
+            ({"size": 1024 * 1024 * 1024, "chunk_size": 64 * 1024}, "chunks"),
+        ):
+            response = self.client.post(
+                self.url + "?is_init=1", {"file_name": "video.mp4", **data}, format="json"
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(message, response.content.decode())
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_abandoned_uploads_expire(self):
+        abandoned = ChunkedUpload.objects.get(pk=self.start_upload())
+        self.send_chunk(abandoned.pk, 0)
+        active = ChunkedUpload.objects.get(pk=self.start_upload())
+        self.send_chunk(active.pk, 1)
+        long_ago = now() - timedelta(days=2)
+        ChunkedUpload.objects.update(updated_at=long_ago)
+        ChunkedUploadPart.objects.filter(upload=abandoned).update(created_at=long_ago)
+
+        output = io.StringIO()
+        call_command("expire_uploads", stdout=output)
+        self.assertIn("Deleted 1 expired uploads", output.getvalue())
+        self.assertEqual(list(ChunkedUpload.objects.values_list("pk", flat=True)), [active.pk])
+        self.assertFalse(STORAGE_CHUNK.exists(abandoned.folder))
+        self.assertTrue(STORAGE_CHUNK.exists(active.folder))
+
+    def test_uploads_of_other_users_are_hidden(self):
+        upload_id = self.start_upload()
+        self.client.force_authenticate(User.objects.create(username="other"))
+        self.assertEqual(self.send_chunk(upload_id, 0).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get("%s%s/" % (self.url, upload_id)).status_code, 404)
@@ -0,0 +1,77 @@
+from unittest import mock
+
+import requests
+from moto import mock_aws
+from rest_framework import status
+from rest_framework.test import APITestCase
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from api.models import User
+from common.models import File
+from common.views.direct_upload import s3_client
+
+
+class DirectUploadTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="admin", is_mosque_admin=True)
+        self.client.force_authenticate(self.user)
+        self.url = "/api/common/direct-upload/"
+
+    def use_s3_storage(self):
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        storage = S3Boto3Storage(bucket_name="masjid-test", location="file", region_name="us-east-1")
+        s3_client(storage).create_bucket(Bucket="masjid-test")
+        patcher = mock.patch.object(File._meta.get_field("file"), "storage", storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return storage
+
+    def test_needs_s3_storage(self):
+        response = self.client.post(self.url, {"file_name": "video.mp4", "size": 10}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_size_is_bounded_by_s3(self):
+        self.use_s3_storage()
+        response = self.client.post(
+            self.url, {"file_name": "video.mp4", "size": 6 * 1024 ** 4}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            self.url, {"file_name": "video.mp4", "size": 20 * 1024 ** 3, "chunk_size": 8 * 1024 ** 3},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["part_size"], 5 * 1024 ** 3)
+        self.assertEqual(response.json()["part_count"], 4)
+
+    def test_parts_go_straight_to_the_bucket(self):
+        storage = self.use_s3_storage()
+
+        part_size = 5 * 1024 * 1024
+        data = bytes(range(256)) * (part_size // 256) + b"tail" * 100
+        response = self.client.post(
+            self.url, {"file_name": "video.mp4", "size": len(data), "chunk_size": part_size}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        upload = response.json()
+        self.assertEqual(upload["part_count"], 2)
+        upload_url = "%s%s/" % (self.url, upload["upload_id"])
+
+        # The last part first, and the upload resumed from its status
+        self.assertEqual(requests.put(upload["urls"]["2"], data=data[part_size:]).status_code, 200)
+        self.assertEqual(self.client.post(upload_url + "complete/").status_code, 400)
+        missing = self.client.get(upload_url).json()
+        self.assertEqual(missing["missing"], [1])
+        self.assertEqual(requests.put(missing["urls"]["1"], data=data[:part_size]).status_code, 200)
+
+        response = self.client.post(upload_url + "complete/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        file = File.objects.get(pk=response.json()["data"]["file_id"])
+        self.assertEqual(file.name, "video.mp4")
+        with storage.open(file.file.name, "rb") as stored:
+            self.assertEqual(stored.read(), data)
+        stored = s3_client(storage).head_object(Bucket="masjid-test", Key="file/" + file.file.name)
+        self.assertEqual(stored["ContentType"], "video/mp4")
+        self.assertEqual(self.client.get(upload_url).status_code, status.HTTP_404_NOT_FOUND)
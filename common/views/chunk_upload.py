@@ -1,19 +1,178 @@
 import hashlib
 import io
-from base64 import b64decode
+import os
+import shutil
+import tempfile
+import uuid
+import zlib
 
 from rest_framework.viewsets import GenericViewSet
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from django.shortcuts import get_object_or_404
 
 from libs.storage import STORAGE_CHUNK
-from ..models import File, ChunkedUpload
+from ..models import File, ChunkedUpload, ChunkedUploadPart
 
 from ..serializers.chunk_upload import ChunkUploadSerializer
 
-MAX_FILE_SIZE = getattr(settings, "UPLOAD_MAX_FILE_SIZE", None)
+MAX_FILE_SIZE = getattr(settings, "UPLOAD_MAX_FILE_SIZE", 2 * 1024 * 1024 * 1024)
+DEFAULT_CHUNK_SIZE = getattr(settings, "UPLOAD_CHUNK_SIZE", 5 * 1024 * 1024)
+MIN_CHUNK_SIZE = getattr(settings, "UPLOAD_MIN_CHUNK_SIZE", 64 * 1024)
+MAX_CHUNK_SIZE = getattr(settings, "UPLOAD_MAX_CHUNK_SIZE", 64 * 1024 * 1024)
+MAX_CHUNK_COUNT = getattr(settings, "UPLOAD_MAX_CHUNK_COUNT", 10000)
+
+# Bytes of the request body read and written at once
+CHUNK_READ_SIZE = 64 * 1024
+
+
+def part_name(upload):
+    return "%s/%s.part" % (upload.folder, upload.pk)
+
+
+class PartFile(DjangoFile):
+    """
+    The received bytes of an upload, which FileSystemStorage moves into place
+    instead of copying.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def write_chunk(upload, number, stream, checksum):
+    """
+    Write the request body ``stream`` as chunk ``number`` of an upload, at
+    its place in the part file. Chunks are written through their own file
+    handle to their own range, so they may arrive in any order and at once.
+    The body is received into a temporary file first and only copied into
+    the part file once its size and MD5 match, so a bad resend never touches
+    the bytes of a recorded chunk. Its record is dropped while the bytes are
+    being replaced.
+
+    :return: An error message, or None once the chunk is recorded.
+    """
+    start, length = upload.chunk_range(number)
+    path = STORAGE_CHUNK.path(part_name(upload))
+    md5 = hashlib.md5()
+    crc32 = 0
+    received = 0
+    with tempfile.TemporaryFile(dir=os.path.dirname(path)) as chunk:
+        while True:
+            data = stream.read(CHUNK_READ_SIZE)
+            if not data:
+                break
+            received += len(data)
+            if received > length:
+                return "Chunk %s is longer than %s bytes." % (number, length)
+            chunk.write(data)
+            md5.update(data)
+            crc32 = zlib.crc32(data, crc32)
+        if received != length:
+            return "Chunk %s is %s bytes, expected %s." % (number, received, length)
+        if md5.hexdigest() != checksum.lower():
+            return "Checksum of chunk %s mismatch." % number
+
+        ChunkedUploadPart.objects.filter(upload=upload, number=number).delete()
+        chunk.seek(0)
+        with open(path, "r+b") as part:
+            part.seek(start)
+            shutil.copyfileobj(chunk, part, CHUNK_READ_SIZE)
+
+    ChunkedUploadPart.objects.update_or_create(
+        upload=upload, number=number,
+        defaults={"size": length, "checksum": checksum.lower(), "crc32": crc32},
+    )
+    return None
+
+
+def number_ranges(numbers):
+    """
+    Group sorted chunk numbers into ``[first, last]`` ranges, both included.
+    """
+    ranges = []
+    for number in numbers:
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ranges
+
+
+def upload_status(upload):
+    # Chunks recorded without their CRC-32 can't be combined, they are sent again
+    received = list(
+        upload.parts.filter(crc32__isnull=False).order_by("number").values_list("number", flat=True)
+    )
+    done = set(received)
+    return {
+        "upload_id": upload.pk,
+        "file_name": upload.filename,
+        "size": upload.size,
+        "chunk_size": upload.chunk_size,
+        "chunk_count": upload.chunk_count,
+        "received": number_ranges(received),
+        "missing": number_ranges(number for number in range(upload.chunk_count) if number not in done),
+        "is_done": upload.is_done,
+    }
+
+
+# Reversed polynomial of CRC-32, as zlib computes it
+CRC32_POLYNOMIAL = 0xEDB88320
+
+
+def gf2_times(matrix, vector):
+    total = 0
+    for row in matrix:
+        if not vector:
+            break
+        if vector & 1:
+            total ^= row
+        vector >>= 1
+    return total
+
+
+def gf2_square(matrix):
+    return [gf2_times(matrix, row) for row in matrix]
+
+
+def crc32_shift(length):
+    """
+    The GF(2) operator turning the CRC-32 of some bytes into that of the
+    same bytes followed by ``length`` zero bytes, as zlib's crc32_combine
+    builds it: the operator of a single zero bit is squared into those of
+    1, 2, 4... zero bytes, and the ones of the bits set in ``length`` are
+    composed.
+    """
+    power = [CRC32_POLYNOMIAL] + [1 << bit for bit in range(31)]
+    for _ in range(3):
+        power = gf2_square(power)
+    operator = [1 << bit for bit in range(32)]
+    while length:
+        if length & 1:
+            operator = [gf2_times(power, row) for row in operator]
+        length >>= 1
+        if length:
+            power = gf2_square(power)
+    return operator
+
+
+def combine_crc32(parts, chunk_size):
+    """
+    The CRC-32 of the concatenation of ``parts``, in order, from their own
+    CRC-32s and sizes. Every chunk but the last shares the shift operator of
+    ``chunk_size`` bytes, so this costs one vector product per chunk.
+    """
+    shift = crc32_shift(chunk_size)
+    crc32 = 0
+    for part in parts:
+        operator = shift if part.size == chunk_size else crc32_shift(part.size)
+        crc32 = gf2_times(operator, crc32) ^ part.crc32
+    return crc32
 
 
 class ChunkUploadViewSet(GenericViewSet):
@@ -21,96 +180,141 @@ class ChunkUploadViewSet(GenericViewSet):
     permission_classes = (IsAuthenticated,)
     file_model_class = File
 
+    def get_queryset(self):
+        return ChunkedUpload.objects.filter(created_by=self.request.user)
+
     def create(self, request):
         """
         Chunk upload file.
 
-        ### Requires
+        ### Start an upload, `?is_init=1`
         * __file_name__
-        * __chunk__
-        * __chunk_no__
-        * __checksum__
-        * __chunk_count__
+        * __size__, of the whole file
+        * __chunk_size__ (optional), from 64 KiB to 64 MiB
+
+        Returns the upload's status, or 400 when the file is too large or
+        would take too many chunks.
+
+        ### Send a chunk, `?upload_id=<id>&chunk_no=<number>&checksum=<md5>`
+        The raw bytes of chunk `chunk_no`, from `chunk_no * chunk_size`, as
+        the body (`application/octet-stream`) and their hexadecimal MD5 as
+        `checksum`. Chunks may be sent in any order and in parallel, and
+        again after a failure.
+
+        ### Finish the upload, `?is_checksum=1`
+        * __upload_id__
+        * __checksum__, hexadecimal CRC-32 of the whole file
         """
+        if request.GET.get("is_init"):
+            return self.init_upload(request)
+        if request.GET.get("is_checksum"):
+            return self.finish_upload(request)
+
+        try:
+            upload_id = int(request.GET["upload_id"])
+            number = int(request.GET["chunk_no"])
+            checksum = request.GET["checksum"]
+        except (KeyError, ValueError):
+            return Response({"message": "upload_id, chunk_no and checksum are required."}, status=400)
+        upload = get_object_or_404(self.get_queryset(), pk=upload_id, is_done=False)
+        if not 0 <= number < upload.chunk_count:
+            return Response({"message": "chunk_no is out of range."}, status=400)
+
+        # An empty body has no stream
+        error = write_chunk(upload, number, request.stream or io.BytesIO(), checksum)
+        if error:
+            return Response({"message": error}, status=400)
+        return Response({"upload_id": upload.pk, "chunk_no": number})
+
+    def retrieve(self, request, pk=None):
+        """
+        Status of an upload, with the ranges of chunks received and missing
+        as `[first, last]`, to resume it after a dropped connection.
+        """
+        return Response(upload_status(get_object_or_404(self.get_queryset(), pk=pk)))
+
+    def init_upload(self, request):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
-
-        storage = STORAGE_CHUNK
-        chunk = serializer.validated_data.get("chunk")
         file_name = serializer.validated_data.get("file_name")
-        chunk_no = serializer.validated_data.get("chunk_no")
+        size = serializer.validated_data.get("size")
+        if not file_name or size is None:
+            return Response({"message": "file_name and size are required."}, status=400)
+        if MAX_FILE_SIZE and size > MAX_FILE_SIZE:
+            return Response(
+                {
+                    "message": "Failed upload file",
+                    "data": {"file_size": size, "allowed_size": MAX_FILE_SIZE},
+                },
+                status=400,
+            )
+        chunk_size = serializer.validated_data.get("chunk_size") or DEFAULT_CHUNK_SIZE
+        if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+            return Response(
+                {"message": "chunk_size must be from %s to %s bytes." % (MIN_CHUNK_SIZE, MAX_CHUNK_SIZE)},
+                status=400,
+            )
+        if -(-size // chunk_size) > MAX_CHUNK_COUNT:
+            return Response(
+                {"message": "The file would take more than %s chunks, send larger ones." % MAX_CHUNK_COUNT},
+                status=400,
+            )
+
+        upload = ChunkedUpload.objects.create(
+            created_by=request.user,
+            filename=os.path.basename(file_name),
+            folder=uuid.uuid4().hex,
+            size=size,
+            chunk_size=chunk_size,
+        )
+        # Allocated to its full size, sparse where the file system allows
+        path = STORAGE_CHUNK.path(part_name(upload))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as part:
+            part.truncate(size)
+        return Response({"created": True, **upload_status(upload)})
+
+    def finish_upload(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
         checksum = serializer.validated_data.get("checksum")
-        chunk_count = serializer.validated_data.get("chunk_count")
+        if not checksum:
+            return Response({"message": "upload_id and checksum are required."}, status=400)
 
-        if request.GET.get("is_init"):
-            _data, created = ChunkedUpload.objects.get_or_create(
-                created_by=request.user,
-                filename=file_name,
+        with transaction.atomic():
+            upload = get_object_or_404(
+                self.get_queryset().select_for_update(),
+                pk=serializer.validated_data.get("upload_id"),
+                is_done=False,
             )
-            data_response = {"created": created}
-
-        elif request.GET.get("is_checksum"):
-            base64_str = ""
-            for iterate in range(chunk_count):
-                chunk_file_name = file_name + ".part_" + str(iterate)
-                chunk_file = storage.open(chunk_file_name, mode="r")
-                base64_str += str(chunk_file.read())
-                storage.delete(chunk_file_name)
-
-            base64_bytes = base64_str.encode("utf-8")
-            hash_md5 = hashlib.md5()
-            hash_md5.update(base64_bytes)
-
-            if checksum == hash_md5.hexdigest():
-                file = b64decode(base64_str.split(",")[-1])
-
-                with io.BytesIO() as f:
-                    f.write(file)
-                    storage.save(file_name, f)
-
-                chunk_file = storage.open(file_name)
-                file_size = chunk_file.size
-                # check size
-                print(file_size, MAX_FILE_SIZE)
-                if MAX_FILE_SIZE and file_size > MAX_FILE_SIZE:
-                    storage.delete(file_name)
-                    return Response(
-                        {
-                            "message": "Failed upload file",
-                            "data": {
-                                "file_size": file_size,
-                                "allowed_size": MAX_FILE_SIZE,
-                            },
-                        }
-                    )
-
-                # save to file
-                file_instance = self.file_model_class.objects.create(
-                    created_by=request.user, name=file_name
-                )
-                file_instance.file.save(file_name, chunk_file, save=True)
-
-                # delete chunk file
-                storage.delete(file_name)
-
-                return Response(
-                    {
-                        "message": "Success upload file",
-                        "data": {
-                            "url": file_instance.get_file(),
-                            "file_id32": file_instance.id32,
-                            "file_name": file_instance.name,
-                        },
-                    }
-                )
+            status = upload_status(upload)
+            if status["missing"]:
+                return Response({"message": "Chunks are missing", "data": status}, status=400)
 
-        else:
-            with io.StringIO() as f:
-                f.write(chunk)
-                storage.save(file_name + ".part_" + str(chunk_no), f)
+            name = part_name(upload)
+            path = STORAGE_CHUNK.path(name)
+            crc32 = combine_crc32(upload.parts.order_by("number"), upload.chunk_size)
+            if checksum.lower() != "%08x" % crc32:
+                return Response({"message": "Checksum mismatch", "data": status}, status=400)
 
-            data_response = {
-                "chunk_no": chunk_no,
-            }
+            # save to file, moved into place rather than copied when possible
+            file_instance = self.file_model_class.objects.create(name=upload.filename)
+            with open(path, "rb") as part:
+                file_instance.file.save(upload.filename, PartFile(part, name=upload.filename), save=True)
+
+            # delete chunk file
+            STORAGE_CHUNK.delete(name)
+            upload.is_done = True
+            upload.save(update_fields=["is_done", "updated_at"])
+            upload.parts.all().delete()
 
-        return Response(data_response)
+        return Response(
+            {
+                "message": "Success upload file",
+                "data": {
+                    "url": file_instance.get_file(),
+                    "file_id": file_instance.pk,
+                    "file_name": file_instance.name,
+                },
+            }
+        )
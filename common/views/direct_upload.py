@@ -0,0 +1,264 @@
+import mimetypes
+import os
+import posixpath
+import uuid
+
+from rest_framework.decorators import action
+from rest_framework.viewsets import GenericViewSet
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from django.conf import settings
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from ..models import File, ChunkedUpload
+
+from ..serializers.chunk_upload import ChunkUploadSerializer
+
+# Limits of S3 multipart uploads, every part but the last is at least
+# MIN_PART_SIZE
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+MAX_PARTS = 10000
+MAX_OBJECT_SIZE = 5 * 1024 * 1024 * 1024 * 1024
+
+MAX_FILE_SIZE = min(getattr(settings, "UPLOAD_MAX_FILE_SIZE", None) or MAX_OBJECT_SIZE, MAX_OBJECT_SIZE)
+DEFAULT_PART_SIZE = getattr(settings, "UPLOAD_PART_SIZE", 8 * 1024 * 1024)
+URL_EXPIRY = getattr(settings, "UPLOAD_URL_EXPIRY", 60 * 60)
+
+
+def file_storage():
+    return File._meta.get_field("file").storage
+
+
+def s3_client(storage):
+    return storage.connection.meta.client
+
+
+def object_key(storage, name):
+    """
+    Key in the bucket of the file ``name`` of an S3 storage, under its
+    ``location``.
+    """
+    return posixpath.join(storage.location, name) if storage.location else name
+
+
+def object_parameters(storage, name):
+    """
+    Parameters of the object ``name`` as the storage sets them when saving
+    it: its content type, ``AWS_S3_OBJECT_PARAMETERS`` and default ACL.
+    """
+    params = {
+        "ContentType": mimetypes.guess_type(name)[0] or storage.default_content_type,
+        **storage.get_object_parameters(name),
+    }
+    if "ACL" not in params and storage.default_acl:
+        params["ACL"] = storage.default_acl
+    return params
+
+
+def part_urls(storage, upload, numbers):
+    """
+    Presigned URLs to PUT parts of a multipart upload straight to the bucket,
+    by part number starting at 1.
+    """
+    client = s3_client(storage)
+    return {
+        number: client.generate_presigned_url(
+            "upload_part",
+            Params={
+                "Bucket": storage.bucket_name,
+                "Key": object_key(storage, upload.folder),
+                "UploadId": upload.multipart_id,
+                "PartNumber": number,
+            },
+            ExpiresIn=URL_EXPIRY,
+        )
+        for number in numbers
+    }
+
+
+def uploaded_parts(storage, upload):
+    """
+    The parts the bucket holds for a multipart upload, as S3 lists them.
+    """
+    client = s3_client(storage)
+    parts = []
+    marker = 0
+    while True:
+        page = client.list_parts(
+            Bucket=storage.bucket_name, Key=object_key(storage, upload.folder),
+            UploadId=upload.multipart_id, PartNumberMarker=marker,
+        )
+        parts.extend(page.get("Parts", []))
+        if not page.get("IsTruncated"):
+            return parts
+        marker = page["NextPartNumberMarker"]
+
+
+def upload_status(storage, upload):
+    received = {part["PartNumber"] for part in uploaded_parts(storage, upload)}
+    missing = [number for number in range(1, upload.chunk_count + 1) if number not in received]
+    return {
+        "upload_id": upload.pk,
+        "file_name": upload.filename,
+        "size": upload.size,
+        "part_size": upload.chunk_size,
+        "part_count": upload.chunk_count,
+        "received": sorted(received),
+        "missing": missing,
+        "urls": part_urls(storage, upload, missing),
+        "expires_in": URL_EXPIRY,
+    }
+
+
+class DirectUploadViewSet(GenericViewSet):
+    """
+    Uploads sent by the client straight to the S3 bucket of the file storage
+    as a multipart upload, through presigned part URLs. The app only starts
+    and completes the upload and creates the File, no byte goes through it.
+    """
+    serializer_class = ChunkUploadSerializer
+    permission_classes = (IsAuthenticated,)
+    file_model_class = File
+
+    def get_queryset(self):
+        return ChunkedUpload.objects.filter(created_by=self.request.user).exclude(multipart_id="")
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.storage = file_storage()
+
+    def create(self, request):
+        """
+        Start a direct upload.
+
+        ### Requires
+        * __file_name__
+        * __size__, of the whole file
+        * __chunk_size__ (optional), size of the parts, from 5 MiB to 5 GiB
+
+        Files are at most 5 TiB, the largest S3 object.
+
+        Returns the presigned URL to PUT each part to, by part number from 1.
+        Each part's `ETag` is kept by the bucket, finish with `complete`.
+        """
+        if not isinstance(self.storage, S3Boto3Storage):
+            return Response({"message": "Direct uploads need the S3 file storage."}, status=400)
+
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        file_name = serializer.validated_data.get("file_name")
+        size = serializer.validated_data.get("size")
+        if not file_name or not size:
+            return Response({"message": "file_name and size are required."}, status=400)
+        if size > MAX_FILE_SIZE:
+            return Response(
+                {
+                    "message": "Failed upload file",
+                    "data": {"file_size": size, "allowed_size": MAX_FILE_SIZE},
+                },
+                status=400,
+            )
+        # Parts of MAX_PART_SIZE hold MAX_OBJECT_SIZE in MAX_PARTS already
+        part_size = min(
+            max(
+                serializer.validated_data.get("chunk_size") or DEFAULT_PART_SIZE,
+                MIN_PART_SIZE,
+                -(-size // MAX_PARTS),
+            ),
+            MAX_PART_SIZE,
+        )
+
+        file_name = os.path.basename(file_name)
+        name = "%s/%s" % (uuid.uuid4().hex, file_name)
+        multipart = s3_client(self.storage).create_multipart_upload(
+            Bucket=self.storage.bucket_name, Key=object_key(self.storage, name),
+            **object_parameters(self.storage, name),
+        )
+        upload = ChunkedUpload.objects.create(
+            created_by=request.user,
+            filename=file_name,
+            folder=name,
+            size=size,
+            chunk_size=part_size,
+            multipart_id=multipart["UploadId"],
+        )
+        return Response(
+            {
+                "upload_id": upload.pk,
+                "part_size": part_size,
+                "part_count": upload.chunk_count,
+                "urls": part_urls(self.storage, upload, range(1, upload.chunk_count + 1)),
+                "expires_in": URL_EXPIRY,
+            }
+        )
+
+    def retrieve(self, request, pk=None):
+        """
+        Status of a direct upload, with the parts the bucket holds and fresh
+        URLs for the missing ones, to resume it.
+        """
+        upload = get_object_or_404(self.get_queryset(), pk=pk, is_done=False)
+        # Parts are only sent through fresh URLs past URL_EXPIRY, resuming
+        # keeps the upload from expiring
+        upload.save(update_fields=["updated_at"])
+        return Response(upload_status(self.storage, upload))
+
+    def destroy(self, request, pk=None):
+        """
+        Abort a direct upload, the bucket drops its parts.
+        """
+        upload = get_object_or_404(self.get_queryset(), pk=pk, is_done=False)
+        s3_client(self.storage).abort_multipart_upload(
+            Bucket=self.storage.bucket_name, Key=object_key(self.storage, upload.folder),
+            UploadId=upload.multipart_id,
+        )
+        upload.delete()
+        return Response(status=204)
+
+    @action(detail=True, methods=["post"])
+    def complete(self, request, pk=None):
+        """
+        Complete a direct upload from the parts the bucket holds, and create
+        its File.
+        """
+        with transaction.atomic():
+            upload = get_object_or_404(self.get_queryset().select_for_update(), pk=pk, is_done=False)
+            parts = uploaded_parts(self.storage, upload)
+            numbers = [part["PartNumber"] for part in parts]
+            if (
+                numbers != list(range(1, upload.chunk_count + 1))
+                or sum(part["Size"] for part in parts) != upload.size
+            ):
+                return Response(
+                    {"message": "Parts are missing", "data": upload_status(self.storage, upload)},
+                    status=400,
+                )
+
+            s3_client(self.storage).complete_multipart_upload(
+                Bucket=self.storage.bucket_name, Key=object_key(self.storage, upload.folder),
+                UploadId=upload.multipart_id,
+                MultipartUpload={
+                    "Parts": [{"PartNumber": part["PartNumber"], "ETag": part["ETag"]} for part in parts]
+                },
+            )
+            # The object is in place already, only point the File at it
+            file_instance = self.file_model_class(name=upload.filename)
+            file_instance.file.name = upload.folder
+            file_instance.save()
+            upload.is_done = True
+            upload.save(update_fields=["is_done", "updated_at"])
+
+        return Response(
+            {
+                "message": "Success upload file",
+                "data": {
+                    "url": file_instance.get_file(),
+                    "file_id": file_instance.pk,
+                    "file_name": file_instance.name,
+                },
+            }
+        )
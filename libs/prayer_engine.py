@@ -0,0 +1,238 @@
+"""
+Vectorized prayer time engine.
+
+The same calculation as ``praytimes.PrayTimes.getTimes`` done with NumPy over
+whole arrays of dates, and of locations when ``lat`` and ``lon`` are arrays
+that broadcast against the dates, e.g. ``lat[:, None]`` for one row per
+mosque. Every step follows the operations of praytimes in the same order so
+that the rounded minutes come out identical.
+"""
+import re
+from datetime import date
+from typing import Dict, Iterable, Union
+
+import numpy as np
+
+TIME_NAMES = (
+    'imsak', 'fajr', 'sunrise', 'dhuhr', 'asr', 'sunset', 'maghrib', 'isha', 'midnight'
+)
+
+# Marks the times that don't occur at the location, '-----' in praytimes
+INVALID_MINUTES = -1
+
+# Julian day of 0001-01-01 minus its proleptic Gregorian ordinal
+JULIAN_ORDINAL_OFFSET = 1721424.5
+
+ASR_FACTORS = {'Standard': 1, 'Hanafi': 2}
+
+
+def _eval(value) -> float:
+    # PrayTimes.eval: the leading number of a setting
+    number = re.split('[^0-9.+-]', str(value), 1)[0]
+    return float(number) if number else 0
+
+
+def _is_min(value) -> bool:
+    # PrayTimes.isMin
+    return isinstance(value, str) and value.find('min') > -1
+
+
+def _sin(d): return np.sin(np.radians(d))
+def _cos(d): return np.cos(np.radians(d))
+def _tan(d): return np.tan(np.radians(d))
+def _arcsin(x): return np.degrees(np.arcsin(x))
+def _arccos(x): return np.degrees(np.arccos(x))
+def _arccot(x): return np.degrees(np.arctan(1.0 / x))
+def _arctan2(y, x): return np.degrees(np.arctan2(y, x))
+
+
+def _fix(a, mode):
+    a = a - mode * np.floor(a / mode)
+    return np.where(a < 0, a + mode, a)
+
+
+def _fixangle(angle): return _fix(angle, 360.0)
+def _fixhour(hour): return _fix(hour, 24.0)
+
+
+def julian_days(dates: Iterable[Union[date, np.datetime64]]) -> np.ndarray:
+    """
+    Julian days at midnight UTC of the given dates.
+
+    :param dates: Dates, or a ``datetime64`` array.
+    """
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    ordinals = dates.astype(np.int64) + date(1970, 1, 1).toordinal()
+    return ordinals + JULIAN_ORDINAL_OFFSET
+
+
+class _Engine:
+    def __init__(self, j_date, lat, lon, settings):
+        self.j_date = j_date
+        self.lat = lat
+        self.lon = lon
+        self.settings = settings
+        self.positions = {}
+
+    def sun_position_at(self, time):
+        # Every time of a day starts from the same few estimates, compute
+        # the sun's position once for each
+        if time not in self.positions:
+            self.positions[time] = self.sun_position(self.j_date + time)
+        return self.positions[time]
+
+    def sun_position(self, jd):
+        d = jd - 2451545.0
+        g = _fixangle(357.529 + 0.98560028 * d)
+        q = _fixangle(280.459 + 0.98564736 * d)
+        L = _fixangle(q + 1.915 * _sin(g) + 0.020 * _sin(2 * g))
+
+        e = 23.439 - 0.00000036 * d
+
+        ra = _arctan2(_cos(e) * _sin(L), _cos(L)) / 15.0
+        eqt = q / 15.0 - _fixhour(ra)
+        decl = _arcsin(_sin(e) * _sin(L))
+        return decl, eqt
+
+    def mid_day(self, time):
+        eqt = self.sun_position_at(time)[1]
+        return _fixhour(12 - eqt)
+
+    def sun_angle_time(self, angle, time, ccw=False):
+        decl = self.sun_position_at(time)[0]
+        noon = self.mid_day(time)
+        t = 1 / 15.0 * _arccos(
+            (-_sin(angle) - _sin(decl) * _sin(self.lat)) / (_cos(decl) * _cos(self.lat))
+        )
+        return noon + (-t if ccw else t)
+
+    def asr_time(self, factor, time):
+        decl = self.sun_position_at(time)[0]
+        angle = -_arccot(factor + _tan(np.abs(self.lat - decl)))
+        return self.sun_angle_time(angle, time)
+
+    def night_portion(self, angle, night):
+        method = self.settings['highLats']
+        portion = 1 / 2.0
+        if method == 'AngleBased':
+            portion = 1 / 60.0 * angle
+        if method == 'OneSeventh':
+            portion = 1 / 7.0
+        return portion * night
+
+    def adjust_high_lat_time(self, time, base, angle, night, ccw=False):
+        portion = self.night_portion(angle, night)
+        diff = _fixhour(base - time) if ccw else _fixhour(time - base)
+        replace = np.isnan(time) | (diff > portion)
+        return np.where(replace, base + (-portion if ccw else portion), time)
+
+    def compute(self, timezone):
+        params = self.settings
+        rise_set_angle = 0.833  # PrayTimes.riseSetAngle at elevation 0
+
+        times = {
+            'imsak': self.sun_angle_time(_eval(params['imsak']), 5 / 24.0, ccw=True),
+            'fajr': self.sun_angle_time(_eval(params['fajr']), 5 / 24.0, ccw=True),
+            'sunrise': self.sun_angle_time(rise_set_angle, 6 / 24.0, ccw=True),
+            'dhuhr': self.mid_day(12 / 24.0),
+            'asr': self.asr_time(
+                ASR_FACTORS.get(params['asr']) or _eval(params['asr']), 13 / 24.0
+            ),
+            'sunset': self.sun_angle_time(rise_set_angle, 18 / 24.0),
+            'maghrib': self.sun_angle_time(_eval(params['maghrib']), 18 / 24.0),
+            'isha': self.sun_angle_time(_eval(params['isha']), 18 / 24.0),
+        }
+
+        tz_adjust = timezone - self.lon / 15.0
+        for name in times:
+            times[name] = times[name] + tz_adjust
+
+        if params['highLats'] != 'None':
+            night = _fixhour(times['sunrise'] - times['sunset'])
+            for name, base, ccw in (
+                ('imsak', 'sunrise', True), ('fajr', 'sunrise', True),
+                ('isha', 'sunset', False), ('maghrib', 'sunset', False),
+            ):
+                times[name] = self.adjust_high_lat_time(
+                    times[name], times[base], _eval(params[name]), night, ccw
+                )
+
+        if _is_min(params['imsak']):
+            times['imsak'] = times['fajr'] - _eval(params['imsak']) / 60.0
+        if _is_min(params['maghrib']):
+            times['maghrib'] = times['sunset'] - _eval(params['maghrib']) / 60.0
+        if _is_min(params['isha']):
+            times['isha'] = times['maghrib'] - _eval(params['isha']) / 60.0
+        times['dhuhr'] = times['dhuhr'] + _eval(params['dhuhr']) / 60.0
+
+        until = times['fajr'] if params['midnight'] == 'Jafari' else times['sunrise']
+        times['midnight'] = times['sunset'] + _fixhour(until - times['sunset']) / 2
+        return times
+
+
+def to_minutes(hours: np.ndarray) -> np.ndarray:
+    """
+    Round times in hours to minutes since midnight the way praytimes formats
+    them, with INVALID_MINUTES for the times that don't occur.
+
+    :param hours: Times in hours, as computed.
+    """
+    invalid = np.isnan(hours)
+    time = _fixhour(np.where(invalid, 0.0, hours) + 0.5 / 60)
+    whole = np.floor(time)
+    minutes = whole * 60 + np.floor((time - whole) * 60)
+    return np.where(invalid, INVALID_MINUTES, minutes).astype(np.int16)
+
+
+def format_minutes(minutes: int) -> str:
+    """
+    Format minutes since midnight as praytimes' 24h format.
+
+    :param minutes: Minutes since midnight, or INVALID_MINUTES.
+    """
+    if minutes == INVALID_MINUTES:
+        return '-----'
+    return '%02d:%02d' % divmod(minutes, 60)
+
+
+def compute_hours(dates, lat, lon, settings: dict, timezone: float = 0) -> Dict[str, np.ndarray]:
+    """
+    Compute the prayer times of every date in hours, before rounding, NaN
+    for the times that don't occur.
+
+    :param dates: Dates, or a ``datetime64`` array.
+    :param lat: Latitude, or an array of latitudes broadcasting against the dates.
+    :param lon: Longitude, or an array of longitudes broadcasting against the dates.
+    :param settings: Calculation parameters, as ``PrayTimes.getSettings()``.
+    :param timezone: Timezone offset in hours, or an array of them.
+    :return: A ``float64`` array of hours per name of TIME_NAMES.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    j_date = julian_days(dates) - lon / (15 * 24.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return _Engine(j_date, lat, lon, settings).compute(timezone)
+
+
+def asr_declinations(dates, lon) -> np.ndarray:
+    """
+    Declination of the sun, in degrees, that the asr of every date is
+    computed with at longitude ``lon``.
+
+    Takes ``dates`` and ``lon`` like compute_hours.
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    j_date = julian_days(dates) - lon / (15 * 24.0)
+    return _Engine(j_date, 0.0, lon, {}).sun_position_at(13 / 24.0)[0]
+
+
+def compute_times(dates, lat, lon, settings: dict, timezone: float = 0) -> Dict[str, np.ndarray]:
+    """
+    Compute the prayer times of every date, in minutes since midnight.
+
+    Takes the same arguments as compute_hours.
+
+    :return: An ``int16`` array of minutes per name of TIME_NAMES.
+    """
+    hours = compute_hours(dates, lat, lon, settings, timezone)
+    return {name: to_minutes(hours[name]) for name in TIME_NAMES}
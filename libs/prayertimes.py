@@ -1,6 +1,13 @@
 from praytimes import PrayTimes
-from datetime import datetime, timedelta
-from typing import List, Dict
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+from typing import Iterable, Iterator, List, Dict, Sequence, Tuple
+
+from libs import prayer_engine, schedule_grid
+from libs.prayer_engine import TIME_NAMES, format_minutes
+
+# datetime.time of every minute of the day, so rows don't build their own
+TIME_OF_MINUTE = [time(minute // 60, minute % 60) for minute in range(24 * 60)]
 
 
 class ShalatSchedule:
@@ -47,39 +54,121 @@ class ShalatSchedule:
         :param timezone: Timezone offset (default: 0 for UTC).
         :return: A list of dictionaries with prayer times for each day.
         """
-        start_date = datetime.now()
+        start_date = datetime.now().date()
         # Approximate 30 days per month
         end_date = start_date + timedelta(days=months * 30)
-        schedule = []
-
-        current_date = start_date
-        while current_date <= end_date:
-            # Convert date to tuple format required by praytimes (YYYY, MM, DD)
-            date_tuple = (current_date.year,
-                          current_date.month, current_date.day)
-
-            # Get prayer times
-            times = self.pray_times.getTimes(
-                date_tuple, (self.lat, self.lon), timezone)
-
-            # Append to schedule
-            schedule.append({
-                'date': current_date.strftime('%Y-%m-%d'),
-                'imsak': times['imsak'],
-                'fajr': times['fajr'],
-                'sunrise': times['sunrise'],
-                'dhuhr': times['dhuhr'],
-                'asr': times['asr'],
-                'sunset': times['sunset'],
-                'maghrib': times['maghrib'],
-                'isha': times['isha'],
-                'midnight': times['midnight']
-            })
-
-            # Move to the next day
-            current_date += timedelta(days=1)
-
-        return schedule
+        return self.get_schedule_between(start_date, end_date, timezone)
+
+    def get_schedule_between(self, start_date: date, end_date: date, timezone: int = 0) -> List[Dict[str, str]]:
+        """
+        Generate a prayer time schedule from start_date to end_date, both
+        included.
+
+        :param start_date: The first day.
+        :param end_date: The last day.
+        :param timezone: Timezone offset (default: 0 for UTC).
+        :return: A list of dictionaries with prayer times for each day.
+        """
+        dates = [
+            start_date + timedelta(days=offset)
+            for offset in range((end_date - start_date).days + 1)
+        ]
+        return self.compute_schedule(dates, timezone)
+
+    def compute_schedule(self, dates: List, timezone: int = 0) -> List[Dict[str, str]]:
+        """
+        Compute the prayer times of all dates at once with the vectorized
+        engine, or from the geo-grid schedule shared with nearby mosques,
+        formatted as ``PrayTimes.getTimes`` does.
+
+        :param dates: The dates to compute.
+        :param timezone: Timezone offset (default: 0 for UTC).
+        :return: A list of dictionaries with prayer times for each day.
+        """
+        return [
+            {
+                'date': day.strftime('%Y-%m-%d'),
+                **{name: format_minutes(value) for name, value in zip(TIME_NAMES, minutes)}
+            }
+            for day, minutes in zip(dates, self.compute_minutes(dates, timezone))
+        ]
+
+    def compute_minutes(self, dates: List, timezone: int = 0) -> List[Tuple[int, ...]]:
+        """
+        Compute the prayer times of all dates in minutes since midnight, -1
+        for times that don't occur, rounded as ``PrayTimes.getTimes`` does.
+
+        :param dates: The dates to compute.
+        :param timezone: Timezone offset (default: 0 for UTC).
+        :return: One tuple of minutes in TIME_NAMES order per date.
+        """
+        params = self.pray_times.getSettings()
+        if schedule_grid.USE_SCHEDULE_GRID:
+            times = schedule_grid.grid_times(dates, self.lat, self.lon, params, timezone)
+            columns = [times[name][0].tolist() for name in TIME_NAMES]
+        else:
+            times = prayer_engine.compute_times(dates, self.lat, self.lon, params, timezone)
+            columns = [times[name].tolist() for name in TIME_NAMES]
+        return list(zip(*columns))
+
+    def iter_schedule(
+        self, start_date: date, end_date: date, timezone: int = 0, block_days: int = 366
+    ) -> Iterator[Dict[str, object]]:
+        """
+        Yield the prayer times of each day from start_date to end_date, both
+        included, as a dictionary of the ``date`` and the ``datetime.time``
+        of each prayer (None when it doesn't occur). Days are computed
+        block_days at a time, so memory doesn't grow with the range.
+
+        :param start_date: The first day.
+        :param end_date: The last day.
+        :param timezone: Timezone offset (default: 0 for UTC).
+        :param block_days: Number of days computed at once.
+        """
+        block_start = start_date
+        while block_start <= end_date:
+            block_end = min(end_date, block_start + timedelta(days=block_days - 1))
+            dates = [
+                block_start + timedelta(days=offset)
+                for offset in range((block_end - block_start).days + 1)
+            ]
+            for day, minutes in zip(dates, self.compute_minutes(dates, timezone)):
+                yield {
+                    'date': day,
+                    **{
+                        name: TIME_OF_MINUTE[value] if value >= 0 else None
+                        for name, value in zip(TIME_NAMES, minutes)
+                    }
+                }
+            block_start = block_end + timedelta(days=1)
+
+
+def compute_fleet_times(
+    mosques: Sequence[Tuple[int, float, float]], start: date, days: int, timezone: int = 0
+) -> Tuple[List[int], Dict[str, List[List[int]]]]:
+    """
+    Compute the prayer times of several mosques over the same days, in
+    minutes since midnight (-1 for times that don't occur). Meant to run in
+    process pool workers, it doesn't touch the database.
+
+    :param mosques: (id, latitude, longitude) of each mosque.
+    :param start: The first day.
+    :param days: Number of days from start.
+    :param timezone: Timezone offset (default: 0 for UTC).
+    :return: The mosque ids, and per time name one row of minutes per mosque.
+    """
+    dates = [start + timedelta(days=offset) for offset in range(days)]
+    ids = [mosque[0] for mosque in mosques]
+    settings = ShalatSchedule(0, 0).pray_times.getSettings()
+    lats = [mosque[1] for mosque in mosques]
+    lons = [mosque[2] for mosque in mosques]
+    if schedule_grid.USE_SCHEDULE_GRID:
+        times = schedule_grid.grid_times(dates, lats, lons, settings, timezone)
+    else:
+        times = prayer_engine.compute_times(
+            dates, [[lat] for lat in lats], [[lon] for lon in lons], settings, timezone
+        )
+    return ids, {name: times[name].tolist() for name in TIME_NAMES}
 
 
 def bulk_create_prayer_times(mosque_id, shalat_times):
@@ -110,16 +199,91 @@ def bulk_create_prayer_times(mosque_id, shalat_times):
         for day in shalat_times
     ]
 
-    # Bulk create prayer times
-    PrayerTime.objects.bulk_create(prayer_times_objects)
+    # Bulk upsert prayer times, days that already exist are replaced
+    upsert_prayer_times(prayer_times_objects)
 
     print(
         f"✅ Successfully inserted {len(prayer_times_objects)} prayer times for mosque {mosque.name}")
 
 
+def upsert_prayer_times(prayer_times, batch_size=None):
+    """
+    Insert PrayerTime records, updating the times of the days a mosque
+    already has on the unique (mosque, date) constraint, and refresh the TV
+    content of their mosques.
+
+    :param prayer_times: Unsaved PrayerTime instances.
+    :param batch_size: Rows per INSERT statement (default: all at once).
+    """
+    from api.models import PrayerTime
+    from api.snapshot import invalidate_tv_content
+    PrayerTime.objects.bulk_create(
+        prayer_times,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['mosque', 'date'],
+        update_fields=[*TIME_NAMES, 'updated_at'],
+    )
+    # bulk_create doesn't send post_save, refresh the TV content ourselves
+    for mosque_id in {prayer_time.mosque_id for prayer_time in prayer_times}:
+        invalidate_tv_content(mosque_id)
+
+
+def write_prayer_times(mosque_id, days: Iterable[Dict[str, object]], batch_size: int = 1000) -> int:
+    """
+    Upsert the days yielded by ``ShalatSchedule.iter_schedule`` for a
+    mosque, batch_size days at a time, so memory stays constant however
+    many days are written. Days with a time that doesn't occur are left out.
+
+    :param mosque_id: The ID of the mosque.
+    :param days: Days as yielded by ``ShalatSchedule.iter_schedule``.
+    :param batch_size: Days per bulk_create.
+    :return: The number of days written.
+    """
+    from api.models import PrayerTime
+
+    days = iter(days)
+    written = 0
+    while True:
+        batch = list(islice(days, batch_size))
+        if not batch:
+            break
+        prayer_times = [
+            PrayerTime(mosque_id=mosque_id, **day) for day in batch if None not in day.values()
+        ]
+        upsert_prayer_times(prayer_times)
+        written += len(prayer_times)
+    return written
+
+
+def last_prayer_date(mosque_id):
+    """
+    Return the last day a mosque has prayer times for, from the end of the
+    (mosque, date) index.
+    """
+    from api.models import PrayerTime
+    return PrayerTime.objects.filter(mosque_id=mosque_id).order_by('-date').values_list(
+        'date', flat=True
+    ).first()
+
+
 def run(mosque_id, months=1):
-    from api.models import Mosque, PrayerTime
+    """
+    Generate the prayer times of a mosque up to months ahead, only for the
+    days after the last one it already has.
+    """
+    from api.models import Mosque
     mosque = Mosque.objects.get(pk=mosque_id)
+    start_date = datetime.now().date()
+    # Approximate 30 days per month
+    end_date = start_date + timedelta(days=months * 30)
+    last_date = last_prayer_date(mosque_id)
+    if last_date is not None and last_date >= start_date:
+        start_date = last_date + timedelta(days=1)
+    if start_date > end_date:
+        print(f"✅ Prayer times of mosque {mosque.name} are up to date")
+        return
+
     schedule = ShalatSchedule(mosque.latitude, mosque.longitude)
-    schedule_data = schedule.get_schedule(months, 7)
-    bulk_create_prayer_times(mosque_id, schedule_data)
+    written = write_prayer_times(mosque_id, schedule.iter_schedule(start_date, end_date, 7))
+    print(f"✅ Successfully inserted {written} prayer times for mosque {mosque.name}")
@@ -0,0 +1,178 @@
+"""
+Geo-grid cache of computed prayer schedules.
+
+Mosques a few hundred metres apart have the same times to the minute, so the
+schedule of a year is computed once per grid cell of ``CELL_SIZE`` degrees
+and shared by every mosque inside the cell.
+
+A cell stores, for every day and time, the minute that all of its points
+round to, or UNDECIDED. The times are continuous in latitude and longitude
+and practically linear across a cell this small, so their values over the
+cell lie between the lowest and highest value at its four corners, widened
+by ``MARGIN_SECONDS`` for the curvature and floating point noise left out.
+When both ends of that interval round to the same minute every point of the
+cell does too. Otherwise, or when the corners are far apart (near the poles,
+where the times change fast and stop being linear), the entry is UNDECIDED
+and the times of those days are computed exactly for each mosque.
+
+Asr depends on ``|lat - declination|``, which isn't smooth where the
+declination equals the latitude: on the days the sun's declination falls
+within the latitude span of a cell, asr may peak between its corners, so it
+is always UNDECIDED there.
+"""
+import hashlib
+import json
+from datetime import date
+from typing import Dict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from libs import prayer_engine
+from libs.prayer_engine import TIME_NAMES
+
+USE_SCHEDULE_GRID = getattr(settings, "USE_PRAYER_SCHEDULE_GRID", True)
+CELL_SIZE = getattr(settings, "PRAYER_SCHEDULE_CELL_SIZE", 0.003)  # ~330 m
+# Cells are cached together by tiles of TILE_CELLS x TILE_CELLS cells, a few
+# entries per town rather than one per cell
+TILE_CELLS = getattr(settings, "PRAYER_SCHEDULE_TILE_CELLS", 32)
+SCHEDULE_CACHE = getattr(settings, "PRAYER_SCHEDULE_CACHE", "prayer_schedule")
+
+MARGIN_SECONDS = 0.05
+MAX_SPREAD_SECONDS = 5
+
+# Entries whose minute differs within the cell
+UNDECIDED = -2
+
+
+def settings_digest(params: dict) -> str:
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def tile_key(tile, year: int, digest: str, timezone: float) -> str:
+    return "prayer-schedule:%s:%s:%s:%s:%s:%s:%s" % (
+        CELL_SIZE, TILE_CELLS, tile[0], tile[1], year, timezone, digest
+    )
+
+
+def cells_of(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Grid cells of the given coordinates, as (row, column) integer pairs.
+    """
+    return np.stack(
+        [np.floor(lats / CELL_SIZE), np.floor(lons / CELL_SIZE)], axis=-1
+    ).astype(np.int64)
+
+
+def compute_cell_years(cells: np.ndarray, year: int, params: dict, timezone: float = 0) -> np.ndarray:
+    """
+    Compute the minutes shared by each cell over a year.
+
+    :param cells: (row, column) of the cells.
+    :param year: The year.
+    :param params: Calculation parameters, as ``PrayTimes.getSettings()``.
+    :param timezone: Timezone offset in hours.
+    :return: An ``int16`` array of shape (cells, TIME_NAMES, days of the year),
+        UNDECIDED where the cell's points don't all round to the same minute.
+    """
+    dates = np.arange(
+        np.datetime64(date(year, 1, 1)), np.datetime64(date(year + 1, 1, 1)), dtype="datetime64[D]"
+    )
+    # Neighbouring cells share corners, compute each corner once
+    offsets = np.array([[0, 0], [0, 1], [1, 0], [1, 1]])
+    corners, cell_corners = np.unique(
+        (cells[:, None, :] + offsets).reshape(-1, 2), axis=0, return_inverse=True
+    )
+    cell_corners = cell_corners.reshape(len(cells), 4)
+    hours = prayer_engine.compute_hours(
+        dates, corners[:, :1] * CELL_SIZE, corners[:, 1:] * CELL_SIZE, params, timezone
+    )
+    declinations = prayer_engine.asr_declinations(dates, corners[:, 1:] * CELL_SIZE)[cell_corners]
+    rows = cells[:, :1]
+    kinked = (
+        (declinations.min(axis=1) <= (rows + 1) * CELL_SIZE)
+        & (declinations.max(axis=1) >= rows * CELL_SIZE)
+    )
+
+    margin = MARGIN_SECONDS / 3600
+    minutes = np.empty((len(cells), len(TIME_NAMES), len(dates)), dtype=np.int16)
+    for index, name in enumerate(TIME_NAMES):
+        values = hours[name][cell_corners]
+        low = values.min(axis=1)
+        high = values.max(axis=1)
+        lower = prayer_engine.to_minutes(low - margin)
+        upper = prayer_engine.to_minutes(high + margin)
+        # NaN at any corner makes both bounds NaN, and INVALID_MINUTES
+        decided = (
+            (lower == upper)
+            & (lower != prayer_engine.INVALID_MINUTES)
+            & (high - low <= MAX_SPREAD_SECONDS / 3600)
+        )
+        if name == 'asr':
+            decided &= ~kinked
+        minutes[:, index] = np.where(decided, lower, UNDECIDED)
+    return minutes
+
+
+def get_cell_years(cells: np.ndarray, year: int, params: dict, timezone: float = 0) -> np.ndarray:
+    """
+    Return the minutes shared by each cell over a year from the cache,
+    computing the cells that aren't cached in one go.
+    """
+    cache = caches[SCHEDULE_CACHE]
+    digest = settings_digest(params)
+    cells = [tuple(cell) for cell in cells.tolist()]
+    keys = {
+        cell: tile_key((cell[0] // TILE_CELLS, cell[1] // TILE_CELLS), year, digest, timezone)
+        for cell in cells
+    }
+    tiles = cache.get_many(set(keys.values()))
+
+    missing = [cell for cell in cells if cell not in tiles.get(keys[cell], {})]
+    if missing:
+        computed = compute_cell_years(np.array(missing), year, params, timezone)
+        changed = {}
+        for cell, minutes in zip(missing, computed):
+            changed.setdefault(keys[cell], tiles.setdefault(keys[cell], {}))[cell] = minutes
+        # Workers filling the same tile at once may drop each other's cells,
+        # which are only computed again
+        cache.set_many(changed)
+    return np.stack([tiles[keys[cell]][cell] for cell in cells])
+
+
+def grid_times(dates, lats, lons, params: dict, timezone: float = 0) -> Dict[str, np.ndarray]:
+    """
+    Compute the prayer times of mosques over the same dates from the shared
+    schedules of their cells, the same minutes as ``prayer_engine.compute_times``.
+
+    :param dates: Dates, or a ``datetime64`` array.
+    :param lats: Latitude of each mosque.
+    :param lons: Longitude of each mosque.
+    :param params: Calculation parameters, as ``PrayTimes.getSettings()``.
+    :param timezone: Timezone offset in hours.
+    :return: An ``int16`` array of shape (mosques, dates) per name of TIME_NAMES.
+    """
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+    lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+    cells, mosque_cells = np.unique(cells_of(lats, lons), axis=0, return_inverse=True)
+    mosque_cells = mosque_cells.reshape(-1)
+
+    minutes = np.empty((len(TIME_NAMES), len(lats), len(dates)), dtype=np.int16)
+    years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    for year in np.unique(years).tolist():
+        columns = np.nonzero(years == year)[0]
+        day_of_year = (dates[columns] - np.datetime64(date(year, 1, 1))).astype(np.int64)
+        cell_years = get_cell_years(cells, year, params, timezone)
+        minutes[:, :, columns] = cell_years[mosque_cells][:, :, day_of_year].transpose(1, 0, 2)
+
+    # Days with an undecided time are computed for the mosque itself
+    mosque_index, date_index = np.nonzero((minutes == UNDECIDED).any(axis=0))
+    if len(mosque_index):
+        exact = prayer_engine.compute_times(
+            dates[date_index], lats[mosque_index], lons[mosque_index], params, timezone
+        )
+        for index, name in enumerate(TIME_NAMES):
+            minutes[index, mosque_index, date_index] = exact[name]
+    return {name: minutes[index] for index, name in enumerate(TIME_NAMES)}
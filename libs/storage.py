@@ -79,6 +79,16 @@ if USE_S3 or USE_DO_SPACE:
     PICTURE_STORAGE = S3Boto3Storage(
         location=get_bucket_location("picture/others"), file_overwrite=False
     )
+    ARCHIVE_STORAGE = S3Boto3Storage(
+        location=get_bucket_location("archive"), file_overwrite=False,
+        default_acl="private", querystring_auth=True,
+    )
+    # published tv content snapshots never change once written, so CDNs
+    # may keep them as long as they like
+    SNAPSHOT_STORAGE = S3Boto3Storage(
+        location=get_bucket_location("file"), file_overwrite=False,
+        object_parameters={"CacheControl": "public, max-age=31536000, immutable"},
+    )
 
 else:
     VIDEO_STORAGE = FileSystemStorage(
@@ -103,6 +113,9 @@ else:
         location="%s/picture/others" % MEDIA_ROOT,
         base_url="%spicture/others/" % UPLOAD_ROOT,
     )
+    # not served, archives of pruned rows
+    ARCHIVE_STORAGE = FileSystemStorage(location="%s/archive" % MEDIA_ROOT)
+    SNAPSHOT_STORAGE = FILE_STORAGE
 
 
 # chunk upload storage
@@ -112,3 +125,6 @@ STORAGE_CHUNK = FileSystemStorage(
 )
 
 CHUNK_UPLOAD_PRIVATE = FileSystemStorage(location=CHUNK_UPLOAD_FINISHED_ROOT)
+
+# offline bundles of the tv content, streamed from the local file system
+STORAGE_BUNDLE = FileSystemStorage(location=settings.MEDIA_ROOT + "/bundle")
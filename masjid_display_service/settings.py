@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from django.utils.translation import gettext_lazy as _
 
@@ -29,6 +30,8 @@ DEBUG = True
 
 PRODUCTION = False
 
+TESTING = sys.argv[1:2] == ["test"]
+
 BASE_URL = "http://127.0.0.1:8000/"
 
 ALLOWED_HOSTS = ['*']
@@ -96,6 +99,49 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # TV content snapshots, shared by every uWSGI worker so an invalidation
+    # made by one process is seen by all. Point this at Redis or Memcached
+    # when running more than one host.
+    'tv_content': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache', 'tv_content'),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Devices of the tokens the device endpoints are called with (see
+    # api.device_cache), apart from the snapshots they would otherwise evict
+    'devices': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache', 'devices'),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Device tokens no device has (see api.device_cache), apart so a scan of
+    # made-up tokens only evicts its own entries
+    'unknown_devices': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache', 'unknown_devices'),
+        'TIMEOUT': 15,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Prayer schedules of geo-grid cells (see libs.schedule_grid), shared by
+    # the workers generating prayer times and kept from one run to the next
+    'prayer_schedule': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache', 'prayer_schedule'),
+        'TIMEOUT': 60 * 60 * 24 * 30,
+        'OPTIONS': {'MAX_ENTRIES': 200000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -153,6 +199,9 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',  # Default: All views require authentication
     ],
     "COERCE_DECIMAL_TO_STRING": False,
+    "DEFAULT_THROTTLE_RATES": {
+        "unknown_device": "30/min",  # Unknown device tokens looked up per client
+    },
 }
 
 # swagger settings
@@ -202,4 +251,9 @@ SIMPLE_JWT = {
 }
 
 
-CORS_ORIGIN_ALLOW_ALL = True
\ No newline at end of file
+CORS_ORIGIN_ALLOW_ALL = True
+
+# Device sync times are written behind by each worker (see api.heartbeat),
+# the tests don't record them, as nothing could write them after the test
+# database is gone
+DEVICE_HEARTBEATS = not TESTING
\ No newline at end of file
@@ -10,7 +10,10 @@ from api.views import (
     SubscriptionViewSet, DeviceViewSet
 )
 from api.views.tv import TVContentViewSet
+from api.views.push import tv_content_stream, tv_content_wait
 from common.views import FileViewSet
+from common.views.chunk_upload import ChunkUploadViewSet
+from common.views.direct_upload import DirectUploadViewSet
 from api.views.home import homepage
 
 # Create a router and register viewsets
@@ -24,6 +27,8 @@ router.register(r'customer/configurations', MasjidConfigurationViewSet, basename
 router.register(r'customer/subscriptions', SubscriptionViewSet, basename='subscription')
 router.register(r'device/tv-content', TVContentViewSet, basename='tvcontent')
 router.register(r'common/file', FileViewSet, basename='file')
+router.register(r'common/chunk-upload', ChunkUploadViewSet, basename='chunkupload')
+router.register(r'common/direct-upload', DirectUploadViewSet, basename='directupload')
 
 # Swagger Schema View
 schema_view = get_schema_view(
@@ -41,6 +46,8 @@ schema_view = get_schema_view(
 
 # Include the router's URLs and documentation endpoints
 urlpatterns = [
+    path('api/device/tv-content/stream/', tv_content_stream, name='tvcontent-stream'),
+    path('api/device/tv-content/wait/', tv_content_wait, name='tvcontent-wait'),
     path('api/', include(router.urls)),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),